@@ -0,0 +1,185 @@
+"""
+Throughput benchmark of the client against the local mock of the REST API
+(mock_server.py).  Nothing leaves the machine.
+
+Run from the root of the repository:
+
+    python benchmarks/bench_client.py [--latency 0.005] [--filesystems 20000] [--output results.json]
+
+The results are written as JSON (to stdout, or to --output), one entry per
+scenario with the number of operations, the total time, the throughput,
+the p50/p95 latency of one operation and the number of requests the mock
+received, so runs can be compared across releases.
+"""
+from argparse import ArgumentParser
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import unity  # noqa: E402
+from unity import codec  # noqa: E402
+from unity.jobs import JobWaiter  # noqa: E402
+import mock_server  # noqa: E402
+
+
+def percentile(durations, fraction):
+    ordered = sorted(durations)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0
+
+
+class Bench:
+
+    def __init__(self, servers):
+        self.servers = servers
+        self.results = []
+
+    def requests(self):
+        return sum(server.RequestHandlerClass.mock.requests for server in self.servers)
+
+    def run(self, name, func, repeat=1, operations=1):
+        """
+        Times 'repeat' calls of func.  Each call does 'operations' operations.
+        """
+        before = self.requests()
+        durations = []
+        start = time.perf_counter()
+        for _ in range(repeat):
+            call = time.perf_counter()
+            func()
+            durations.append(time.perf_counter() - call)
+        total = time.perf_counter() - start
+        ops = repeat * operations
+        result = {'name': name, 'operations': ops, 'seconds': round(total, 4),
+                  'ops_per_second': round(ops / total, 1) if total else None,
+                  'p50_ms': round(percentile(durations, 0.50) * 1000, 2),
+                  'p95_ms': round(percentile(durations, 0.95) * 1000, 2),
+                  'requests': self.requests() - before}
+        self.results.append(result)
+        print('{:<32} {:>8} ops {:>9.3f} s {:>10} ops/s'.format(name, ops, total, result['ops_per_second']),
+              file=sys.stderr)
+        return result
+
+
+def check(results):
+    """
+    Fails the benchmark when creates failed, so they are not timed as successes.
+    """
+    errors = [r.error for r in results if r.error is not None]
+    assert not errors, '{} of {} creates failed, first error: {}'.format(len(errors), len(results), errors[0])
+
+
+def version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.002, help='Seconds added to every request by the mock')
+    parser.add_argument('--filesystems', type=int, default=10000)
+    parser.add_argument('--padding', type=int, default=0, help='Bytes of padding per entry')
+    parser.add_argument('--repeat', type=int, default=200, help='Number of single instance queries')
+    parser.add_argument('--creates', type=int, default=500, help='Number of filesystems to create')
+    parser.add_argument('--file-size', type=int, default=8 << 20, help='Size of the downloaded file')
+    parser.add_argument('--output', help='Write the JSON results to this file')
+    opts = parser.parse_args()
+
+    settings = dict(latency=opts.latency, padding=opts.padding, job_time=0.01, file_size=opts.file_size)
+    prod_server, prod = mock_server.start(filesystems=opts.filesystems, **settings)
+    cob_server, cob = mock_server.start(filesystems=opts.filesystems, **settings)
+    bench = Bench([prod_server, cob_server])
+    user, password = mock_server.USER, mock_server.PASSWORD
+
+    def login():
+        nas = unity.Unity(prod, user, password, scheme='http')
+        nas.connect(quiet=True)
+        nas.disconnect()
+
+    bench.run('login+logout', login, repeat=20)
+
+    nas = unity.Unity(prod, user, password, scheme='http', transport=unity.Transport(pool_size=32))
+    nas.connect(quiet=True)
+    names = ['fs{:06}'.format(i) for i in range(opts.filesystems)]
+
+    bench.run('get instance by name', lambda: nas.get('filesystem', rname=names[len(names) // 2],
+                                                      fields='name,sizeTotal,pool'), repeat=opts.repeat)
+    bench.run('get collection (1 page)', lambda: nas.get('filesystem', fields='name,sizeTotal,pool'), repeat=20)
+    for workers in (1, 4):
+        bench.run('iter collection workers={}'.format(workers),
+                  lambda: sum(1 for _ in nas.iter('filesystem', fields='name,sizeTotal,pool', workers=workers)),
+                  repeat=3, operations=opts.filesystems)
+    bench.run('get_table', lambda: nas.get_table('filesystem', 'name,pool,sizeTotal,sizeAllocated', workers=4),
+              repeat=3, operations=opts.filesystems)
+
+    items = [('bench{:06}'.format(i), 'pool_1', 'nas_1', '5G') for i in range(opts.creates)]
+    bench.run('bulk_create Filesystem',
+              lambda: check(nas.storageResource.bulk_create('Filesystem', items, concurrency=8)),
+              operations=opts.creates)
+
+    def jobs():
+        waiter = JobWaiter([nas.create_async('nfsShare', '1', '/', 'share{}'.format(i)) for i in range(100)],
+                           interval=0.02)
+        done = waiter.wait()
+        assert all(job.ok and job.progress == 100 for job in done), 'Jobs did not all finish at 100%'
+
+    bench.run('create_async + JobWaiter', jobs, operations=100)
+
+    def batch():
+        with nas.batch('bench', interval=0.02) as b:
+            for i in range(100):
+                b.create('nfsShare', '1', '/', 'batch{}'.format(i))
+
+    bench.run('batch of 100 creates', batch, operations=100)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'upload')
+        with open(path, 'wb') as f:
+            f.write(b'#' * opts.file_size)
+        bench.run('download', lambda: nas.download('nas_1', 7), repeat=5)
+        bench.run('upload', lambda: nas.upload('nas_1', 7, path), repeat=5)
+
+    def provision():
+        # Like unity_prov.py: one prod/cob frame pair, check the pools, then
+        # create the filesystems of every NAS server on both frames, by name
+        for frame in (prod, cob):
+            array = unity.Unity(frame, user, password, scheme='http')
+            array.connect(quiet=True)
+            array.get('pool', fields='name,sizeTotal,sizeSubscribed')
+            rows = [('prov{:05}'.format(i), 'Pool_1', 'nas{:02}'.format(i % 30 + 1), '10G') for i in range(200)]
+            check(array.storageResource.bulk_create('Filesystem', rows, concurrency=8, resolve=True))
+            array.disconnect()
+
+    bench.run('provisioning workflow', provision, operations=400)
+
+    report = {
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'version': version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'codec': codec.name,
+        'settings': vars(opts),
+        'results': bench.results,
+    }
+    output = json.dumps(report, indent=2)
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    prod_server.shutdown()
+    cob_server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
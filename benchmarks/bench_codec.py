@@ -0,0 +1,103 @@
+"""
+Micro-benchmark of the JSON paths of the client: the original one
+(response.json() and json.dumps(..., indent=4) with a lambda default) and
+the unity.codec one.
+
+Run from the root of the repository:
+
+    python benchmarks/bench_codec.py [--repeat N] [page.json ...]
+
+Recorded API responses (for instance a page of 'event' saved with
+curl) can be given as arguments.  Without arguments, pages shaped like
+'event' and 'filesystem' collection pages are generated.
+"""
+from argparse import ArgumentParser
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from unity import classes, codec  # noqa: E402
+
+
+def event_page(entries=2000):
+    return {
+        '@base': 'https://unity01/api/types/event/instances?fields=node,creationTime,severity,messageId,'
+                 'arguments,message,username,category,source&per_page=2000',
+        'updated': '2019-10-01T10:00:00.000Z',
+        'links': [{'rel': 'self', 'href': '&page=1'}, {'rel': 'next', 'href': '&page=2'}],
+        'entryCount': entries * 10,
+        'entries': [{
+            '@base': 'https://unity01/api/instances/event',
+            'updated': '2019-10-01T10:00:00.000Z',
+            'links': [{'rel': 'self', 'href': '/{}'.format(i)}],
+            'content': {
+                'id': str(i), 'node': 1, 'creationTime': '2019-09-29T03:45:06.402Z', 'severity': 6,
+                'messageId': '14:60a32', 'arguments': ['admin', '10.0.0.{}'.format(i % 255)],
+                'message': 'User admin logged in from 10.0.0.{} using the REST API.'.format(i % 255),
+                'username': 'System', 'category': 'User', 'source': 'Management'
+            }
+        } for i in range(entries)]
+    }
+
+
+def filesystem_page(entries=2000):
+    return {
+        'entryCount': entries,
+        'entries': [{'content': {
+            'id': 'fs_{}'.format(i), 'name': 'fs_{}'.format(i), 'sizeTotal': 107374182400 + i,
+            'sizeAllocated': 53687091200, 'sizeUsed': 1234567890 * (i % 7), 'health': {'value': 5},
+            'pool': {'id': 'pool_{}'.format(i % 4)}, 'nasServer': {'id': 'nas_{}'.format(i % 30)},
+            'storageResource': {'id': 'res_{}'.format(i)}, 'description': 'Filesystem number {}'.format(i)
+        }} for i in range(entries)]
+    }
+
+
+def old_dumps(obj):
+    return json.dumps(obj.__dict__, default=lambda o: o.__dict__, indent=4)
+
+
+def bench(label, func, repeat):
+    best = min(timeit.repeat(func, number=1, repeat=repeat))
+    print('{:<45} {:>10.2f} ms'.format(label, best * 1000))
+    return best
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('pages', nargs='*', help='Recorded API responses (JSON files)')
+    opts = parser.parse_args()
+
+    if opts.pages:
+        pages = {}
+        for path in opts.pages:
+            with open(path, 'rb') as f:
+                pages[os.path.basename(path)] = f.read()
+    else:
+        pages = {'event page (2000)': json.dumps(event_page()).encode(),
+                 'filesystem page (2000)': json.dumps(filesystem_page()).encode()}
+
+    print('codec: {}'.format(codec.name))
+    print('Decoding responses:')
+    for label, raw in pages.items():
+        old = bench('  {} [json.loads(str)]'.format(label), lambda: json.loads(raw.decode('utf-8')), opts.repeat)
+        new = bench('  {} [codec.loads(bytes)]'.format(label), lambda: codec.loads(raw), opts.repeat)
+        print('  {:<43} {:>10.1f} x'.format('speedup', old / new))
+
+    print('Encoding payloads:')
+    payloads = [classes.Filesystem('fs_{}'.format(i), 'pool_1', 'nas_1', '100G', description='Filesystem',
+                                   isThinEnabled=True, isReplicationDestination=False)
+                for i in range(2000)]
+    old = bench('  2000 Filesystem [json.dumps indent=4]', lambda: [old_dumps(p) for p in payloads], opts.repeat)
+    new = bench('  2000 Filesystem [classes.jsonify]', lambda: [classes.jsonify(p) for p in payloads], opts.repeat)
+    old_size = sum(len(old_dumps(p).encode()) for p in payloads)
+    new_size = sum(len(classes.jsonify(p)) for p in payloads)
+    print('  {:<43} {:>10.1f} x'.format('speedup', old / new))
+    print('  {:<43} {:>7} -> {} bytes'.format('size on the wire', old_size, new_size))
+
+
+if __name__ == '__main__':
+    main()
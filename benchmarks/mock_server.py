@@ -0,0 +1,312 @@
+"""
+Local mock of the Unity REST API, to benchmark the client without an array.
+
+It implements what the client uses: the login (basic auth on system/0,
+cookie and EMC-CSRF-TOKEN), paged collections (per_page, page, fields and
+'id in (...)' filters), instance queries by ID or name, creates (including
+storageResource actions), modify/delete/actions, jobs (timeout=0 and
+batches of tasks), logout, and the download/upload of NAS server files.
+Every request waits 'latency' seconds, and entries can be padded to make
+the payloads bigger.
+
+Run it on its own:
+
+    python benchmarks/mock_server.py --port 8080 --latency 0.01 --filesystems 20000
+
+and point the client at it with Unity('127.0.0.1:8080', 'admin', 'password', scheme='http').
+"""
+from argparse import ArgumentParser
+import base64
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import itertools
+import json
+import re
+import socket
+import threading
+import time
+from urllib.parse import parse_qs, unquote, urlsplit
+
+USER = 'admin'
+PASSWORD = 'password'
+
+
+class MockUnity:
+
+    def __init__(self, latency: float = 0, filesystems: int = 1000, snaps: int = 0, pools: int = 4,
+                 nas_servers: int = 30, padding: int = 0, job_time: float = 0.05, file_size: int = 1 << 20):
+        """
+        State of the mocked array.
+        :param latency: Seconds added to every request
+        :param filesystems: Number of filesystems (and storage resources) at start
+        :param snaps: Number of snapshots at start
+        :param pools: Number of pools
+        :param nas_servers: Number of NAS servers
+        :param padding: Bytes of padding added to the 'description' of every entry
+        :param job_time: Seconds a job takes to complete
+        :param file_size: Size of the downloaded NAS server files, in bytes
+        """
+        self.latency = latency
+        self.padding = 'x' * padding
+        self.job_time = job_time
+        self.file = b'#' * file_size
+        self.lock = threading.Lock()
+        self.counter = itertools.count(1)
+        # Login sessions: cookie -> CSRF token
+        self.sessions = {}
+        self.requests = 0
+        self.instances = {}
+        for i in range(pools):
+            self.add('pool', {'id': 'pool_{}'.format(i + 1), 'name': 'Pool_{}'.format(i + 1),
+                              'sizeTotal': 100 << 40, 'sizeUsed': 10 << 40, 'sizeFree': 90 << 40,
+                              'sizeSubscribed': 50 << 40})
+        for i in range(nas_servers):
+            self.add('nasServer', {'id': 'nas_{}'.format(i + 1), 'name': 'nas{:02}'.format(i + 1),
+                                   'pool': {'id': 'pool_{}'.format(i % pools + 1)}, 'homeSP': {'id': 'spa'},
+                                   'currentSP': {'id': 'spa'}, 'health': {'value': 5}})
+        for i in range(filesystems):
+            self.add_filesystem('fs{:06}'.format(i), 'pool_{}'.format(i % pools + 1),
+                                'nas_{}'.format(i % nas_servers + 1), 5 << 30)
+        for i in range(snaps):
+            self.add('snap', {'id': str(38654705664 + i), 'name': 'snap{:07}'.format(i),
+                              'storageResource': {'id': 'res_{}'.format(i % max(1, filesystems) + 1)},
+                              'creationTime': '2019-10-01T10:00:00.000Z', 'size': 1 << 30})
+
+    def add(self, resource, content):
+        content.setdefault('description', self.padding)
+        self.instances.setdefault(resource, OrderedDict())[content['id']] = content
+        return content
+
+    def new_id(self, prefix):
+        return '{}_{}'.format(prefix, next(self.counter) + 100000)
+
+    def add_filesystem(self, name, pool, nas_server, size):
+        res = self.new_id('res')
+        fs = self.new_id('fs')
+        self.add('storageResource', {'id': res, 'name': name, 'type': 1, 'filesystem': {'id': fs}})
+        self.add('filesystem', {'id': fs, 'name': name, 'pool': {'id': pool}, 'nasServer': {'id': nas_server},
+                                'storageResource': {'id': res}, 'sizeTotal': size, 'sizeUsed': 0,
+                                'sizeAllocated': size // 10, 'health': {'value': 5}})
+        return res
+
+    def find(self, resource, key):
+        instances = self.instances.get(resource, {})
+        if key.startswith('name:'):
+            name = unquote(key[5:])
+            for content in instances.values():
+                if content.get('name') == name:
+                    return content
+            return None
+        return instances.get(key)
+
+    def job(self, tasks, results):
+        now = time.monotonic()
+        job = self.add('job', {'id': 'N-{}'.format(next(self.counter)), 'state': 2, 'progressPct': 0,
+                               'tasks': [{'name': t, 'parametersOut': r} for t, r in zip(tasks, results)],
+                               'start': now, 'done': now + self.job_time})
+        return {'id': job['id']}
+
+    @staticmethod
+    def fields(content, fields):
+        if not fields:
+            return {'id': content['id']}
+        names = {f.split('.')[0] for f in fields.split(',')} | {'id'}
+        return {k: v for k, v in content.items() if k in names}
+
+    def job_content(self, content):
+        if content.get('state') == 2:
+            now = time.monotonic()
+            if now >= content['done']:
+                content['state'] = 4
+                content['progressPct'] = 100
+            else:
+                # Running jobs report their progress like the array does
+                span = content['done'] - content['start']
+                content['progressPct'] = int(100 * (now - content['start']) / span) if span else 0
+        return {k: v for k, v in content.items() if k not in ('start', 'done')}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    mock = None
+
+    def setup(self):
+        super().setup()
+        # Headers and body are written separately: without this, delayed ACKs
+        # add ~40 ms to every response
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, status, body=None, headers=None):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        binary = isinstance(body, bytes)
+        self.send_header('Content-Type', 'application/octet-stream' if binary else 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def error(self, status, message):
+        self.send(status, {'error': {'errorCode': status, 'httpStatusCode': status,
+                                     'messages': [{'en-US': message}]}})
+
+    def body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def cookie(self):
+        match = re.search(r'mod_sec_emc=([^;\s]+)', self.headers.get('Cookie') or '')
+        return match.group(1) if match else None
+
+    def authorized(self, write=False):
+        token = self.mock.sessions.get(self.cookie())
+        if token is None:
+            return False
+        return not write or self.headers.get('EMC-CSRF-TOKEN') == token
+
+    def handle_request(self, method):
+        mock = self.mock
+        with mock.lock:
+            mock.requests += 1
+        if mock.latency:
+            time.sleep(mock.latency)
+        url = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        path = url.path.strip('/').split('/')
+        body = self.body() if method in ('POST', 'DELETE') else b''
+
+        if method == 'GET' and path[:3] == ['api', 'instances', 'system'] and self.headers.get('Authorization'):
+            if self.headers['Authorization'] != 'Basic ' + base64.b64encode(
+                    '{}:{}'.format(USER, PASSWORD).encode()).decode():
+                return self.error(401, 'Unauthorized')
+            with mock.lock:
+                cookie = 'c{}'.format(next(mock.counter))
+                token = mock.sessions[cookie] = 't{}'.format(next(mock.counter))
+            return self.send(200, {'content': {'id': '0', 'name': 'mock', 'model': 'Unity 500',
+                                               'platform': 'Mock', 'serialNumber': 'MOCK0001'}},
+                             {'EMC-CSRF-TOKEN': token, 'Set-Cookie': 'mod_sec_emc={}; Path=/'.format(cookie)})
+        if not self.authorized(write=method != 'GET'):
+            return self.error(401, 'Unauthorized')
+
+        if path[0] == 'download':
+            return self.send(200, mock.file)
+        if path[0] == 'upload':
+            return self.send(200, {})
+        if path[:2] == ['api', 'types'] and path[2] == 'loginSessionInfo':
+            mock.sessions.pop(self.cookie(), None)
+            return self.send(200, {})
+
+        with mock.lock:
+            if path[:2] == ['api', 'types'] and len(path) == 4 and path[3] == 'instances':
+                resource = path[2]
+                if method == 'GET':
+                    return self.collection(resource, query)
+                return self.create(resource, json.loads(body or b'{}'), query)
+            if path[:4] == ['api', 'types', 'storageResource', 'action']:
+                payload = json.loads(body or b'{}')
+                params = payload.get('fsParameters', {})
+                res = mock.add_filesystem(payload.get('name'), params.get('pool', {}).get('id'),
+                                          params.get('nasServer', {}).get('id'), params.get('size', 0))
+                return self.answer({'storageResource': {'id': res}}, query)
+            if path[:2] == ['api', 'instances'] and len(path) >= 4:
+                resource, key = path[2], path[3]
+                content = mock.find(resource, key)
+                if content is None:
+                    return self.error(404, 'The requested resource does not exist.')
+                if method == 'GET':
+                    if resource == 'job':
+                        content = mock.job_content(content)
+                    return self.send(200, {'content': mock.fields(content, query.get('fields'))})
+                if method == 'DELETE':
+                    del mock.instances[resource][content['id']]
+                    return self.answer(None, query)
+                if len(path) == 6 and path[4] == 'action':
+                    if path[5] == 'modify':
+                        content.update(json.loads(body or b'{}'))
+                    return self.answer(None, query)
+        return self.error(404, 'Unknown endpoint {}'.format(url.path))
+
+    def answer(self, result, query):
+        """
+        Answers a write: right away, or with the ID of a job if timeout=0.
+        """
+        if query.get('timeout') == '0':
+            return self.send(202, self.mock.job(['task1'], [result or {}]))
+        if result is None:
+            return self.send(204)
+        return self.send(201, {'content': result})
+
+    def collection(self, resource, query):
+        mock = self.mock
+        instances = list(mock.instances.get(resource, {}).values())
+        ids = re.match(r'\s*id in \((.*)\)\s*$', query.get('filter', ''))
+        if ids:
+            wanted = {v.strip().strip('"') for v in ids.group(1).split(',')}
+            instances = [c for c in instances if c['id'] in wanted]
+        per_page = int(query.get('per_page', 2000))
+        page = int(query.get('page', 1))
+        chunk = instances[(page - 1) * per_page:page * per_page]
+        links = [{'rel': 'self', 'href': '&page={}'.format(page)}]
+        if page * per_page < len(instances):
+            links.append({'rel': 'next', 'href': '&page={}'.format(page + 1)})
+        fields = query.get('fields')
+        entries = [{'content': mock.job_content(c) if resource == 'job' else mock.fields(c, fields)}
+                   for c in chunk]
+        return self.send(200, {'entryCount': len(instances), 'links': links, 'entries': entries})
+
+    def create(self, resource, payload, query):
+        mock = self.mock
+        if resource == 'job':
+            results = [{'id': mock.new_id(t.get('object', 'x'))} for t in payload.get('tasks', [])]
+            return self.send(202, mock.job([t.get('name') for t in payload.get('tasks', [])], results))
+        content = mock.add(resource, dict(payload, id=mock.new_id(resource)))
+        return self.answer({'id': content['id']}, query)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+
+def start(port: int = 0, **kwargs):
+    """
+    Starts a mock array in a background thread.
+    :param port: Port to listen on (0 picks a free one)
+    :param kwargs: Settings of the MockUnity
+    :return: (server, 'host:port')
+    """
+    handler = type('MockHandler', (Handler,), {'mock': MockUnity(**kwargs)})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, '127.0.0.1:{}'.format(server.server_port)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--filesystems', type=int, default=1000)
+    parser.add_argument('--snaps', type=int, default=0)
+    parser.add_argument('--padding', type=int, default=0)
+    parser.add_argument('--job-time', type=float, default=0.05)
+    opts = parser.parse_args()
+    server, address = start(opts.port, latency=opts.latency, filesystems=opts.filesystems, snaps=opts.snaps,
+                            padding=opts.padding, job_time=opts.job_time)
+    print('Mock Unity listening on {} (user {!r}, password {!r})'.format(address, USER, PASSWORD))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,3 +2,19 @@ __author__ = "Brian Hall <brian.hall@hitachivantara.com>"
 
 from unity import classes
 from unity.unity import Unity
+from unity.fleet import UnityFleet
+from unity.cache import ResponseCache
+from unity.jobs import Job, JobWaiter
+from unity.sessions import SessionStore
+from unity.transport import Transport
+from unity.table import Table
+from unity.inventory import Inventory
+from unity.trace import Tracer
+
+
+def __getattr__(name):
+    # aiohttp is only loaded by the scripts that use AsyncUnity
+    if name == 'AsyncUnity':
+        from unity.aio import AsyncUnity
+        return AsyncUnity
+    raise AttributeError("module 'unity' has no attribute {!r}".format(name))
@@ -0,0 +1,327 @@
+import asyncio
+from unity import classes, codec
+from unity.unity import Unity
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncResponse:
+    """
+    Status, headers and body of a request sent by AsyncUnity.  The body is
+    read before the connection goes back to the pool.
+    """
+    __slots__ = ('status', 'headers', 'content')
+
+    def __init__(self, status, headers, content):
+        self.status = status
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        return codec.decode(self)
+
+
+class AsyncUnity:
+
+    def __init__(self, name, user, password, scheme: str = 'https', limit: int = 100):
+        """
+        asyncio version of the Unity client.  It has the same functions as
+        Unity, but every one of them is a coroutine, so many arrays can be
+        driven from one event loop.
+
+        Requests go through a single aiohttp session, which keeps a pool of
+        connections to the array open.  Payloads are built with the classes
+        in classes.py, exactly like the Unity client.
+
+        Example:
+
+            > async with AsyncUnity('hostname', user, password) as nas:
+            >     pools = await nas.get('pool', fields='name,sizeTotal')
+
+        :param name: This is the name or IP of the Unity
+        :param user: Username to log in with
+        :param password: Password to log in with
+        :param scheme: URL scheme of the API ('http' for a local mock)
+        :param limit: Maximum number of open connections to the array
+        """
+        self.name = name
+        self.user = user
+        self.password = password
+        self.url = '{}://{}'.format(scheme, name)
+        self.limit = limit
+        self.session = None
+        self.headers = None
+        self.login_lock = None
+        self.storageResource = None
+
+    async def __aenter__(self):
+        await self.connect(quiet=True)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.disconnect()
+
+    async def _send(self, method, endpoint, **kwargs):
+        """
+        Sends one request and reads the whole body before releasing the
+        connection back to the pool.
+        :return: AsyncResponse
+        """
+        headers = dict(self.headers)
+        headers.update(kwargs.pop('headers', {}))
+        if kwargs.get('params'):
+            # aiohttp only takes strings and numbers as query parameters
+            kwargs['params'] = {k: str(v).lower() if isinstance(v, bool) else v
+                                for k, v in kwargs['params'].items()}
+        async with self.session.request(method, endpoint, headers=headers, **kwargs) as response:
+            return AsyncResponse(response.status, response.headers, await response.read())
+
+    async def _request(self, method, endpoint, **kwargs):
+        """
+        Sends one request.  When the array refuses it because the session
+        expired (401) or the CSRF token is stale (403), logs in again and
+        sends it once more, like the response hook of the Unity client.
+        :return: AsyncResponse
+        """
+        token = self.headers.get('EMC-CSRF-TOKEN')
+        response = await self._send(method, endpoint, **kwargs)
+        if response.status in (401, 403) and await self._relogin(token):
+            response = await self._send(method, endpoint, **kwargs)
+        return response
+
+    async def _login(self):
+        """
+        Authenticates the session with the user/password, and stores the CSRF token.
+        :return: The response of the login query
+        """
+        login_uri = '{}/{}'.format(self.url, 'api/instances/system/0')
+        parameters = {
+            'compact': 'true',
+            'fields': 'name,platform,model,serialNumber'
+        }
+        login = await self._send('GET', login_uri, params=parameters)
+        token = login.headers.get('EMC-CSRF-TOKEN')
+        if token:
+            self.headers['EMC-CSRF-TOKEN'] = token
+        return login
+
+    async def _relogin(self, token):
+        """
+        Logs in again after the array refused a request sent with the given
+        CSRF token.
+        :return: True if the request can be sent again
+        """
+        if self.session is None:
+            return False
+        async with self.login_lock:
+            # Another task may have logged in again while this request was out
+            if self.headers.get('EMC-CSRF-TOKEN') == token:
+                self.session.cookie_jar.clear()
+                login = await self._login()
+                if login.status != 200:
+                    return False
+        return True
+
+    async def connect(self, quiet: bool = False):
+        """
+        Coroutine to connect to the Unity REST API.  See Unity.connect()
+        """
+        if aiohttp is None:
+            print('The aiohttp package is required for AsyncUnity.')
+            return
+        if self.session is not None:
+            print('A session already exists for this object')
+            return
+        self.headers = {
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+            'X-EMC-REST-CLIENT': 'true'
+        }
+        # The array is usually addressed by IP, which the default cookie jar refuses
+        self.session = aiohttp.ClientSession(
+            auth=aiohttp.BasicAuth(self.user, self.password),
+            connector=aiohttp.TCPConnector(limit=self.limit, ssl=False),
+            cookie_jar=aiohttp.CookieJar(unsafe=True)
+        )
+        self.login_lock = asyncio.Lock()
+        try:
+            login = await self._login()
+        except Exception:
+            # Do not leave the connector open when the array cannot be reached
+            await self.session.close()
+            self.session = None
+            raise
+        self.storageResource = AsyncStorageResource(self)
+        if quiet is False:
+            return codec.decode(login)
+
+    async def disconnect(self):
+        """
+        Coroutine to logout of the Unity REST API and close the connections.
+        """
+        if self.session is None:
+            print('There is no active session to disconnect for this object')
+            return
+        logout_uri = '{}/api/types/loginSessionInfo/action/logout'.format(self.url)
+        try:
+            await self._request('POST', logout_uri)
+        finally:
+            await self.session.close()
+            self.session = None
+            self.storageResource = None
+
+    @staticmethod
+    def jsonify(data):
+        return classes.jsonify(data)
+
+    def _instance(self, resource, rname=None, rid=None):
+        if rname:
+            return '{}/{}/{}/{}'.format(self.url, 'api/instances', resource, 'name:{}'.format(rname))
+        return '{}/{}/{}/{}'.format(self.url, 'api/instances', resource, rid)
+
+    async def get(self, resource, rname=None, rid=None, **kwargs):
+        """
+        Coroutine version of Unity.get()
+        """
+        if rname and rid:
+            print('You cannot specify both a name and an ID.')
+            return
+        elif rname or rid:
+            endpoint = self._instance(resource, rname, rid)
+        else:
+            endpoint = '{}/{}/{}/{}'.format(self.url, 'api/types', resource, 'instances')
+        response = await self._request('GET', endpoint, params=kwargs)
+        return codec.decode(response)
+
+    async def iter(self, resource, fields=None, filter=None, page_size: int = 2000, **kwargs):
+        """
+        Async generator version of Unity.iter().  Pages are fetched one at a time.
+
+            > async for entry in nas.iter('snap', fields='name'):
+        """
+        endpoint = '{}/{}/{}/{}'.format(self.url, 'api/types', resource, 'instances')
+        params = dict(kwargs, per_page=page_size)
+        if fields:
+            params['fields'] = fields
+        if filter:
+            params['filter'] = filter
+        page = 1
+        while page:
+            params['page'] = page
+            response = await self._request('GET', endpoint, params=params)
+            body = codec.decode(response)
+            if 'error' in body:
+                print('Query of {} failed on page {}: {}'.format(resource, page, body['error']))
+                return
+            entries = body.get('entries', [])
+            for entry in entries:
+                yield entry
+            page = Unity.next_page(body) if entries else None
+
+    async def create(self, resource, *args, timeout=None, **kwargs):
+        """
+        Coroutine version of Unity.create()
+        """
+        obj = classes.build(resource, *args, **kwargs)
+        if obj is None:
+            return
+        body = AsyncUnity.jsonify(obj)
+        timeout = Unity.timeout_params(timeout)
+        endpoint = '{}/{}/{}/{}'.format(self.url, 'api/types', resource, 'instances')
+        response = await self._request('POST', endpoint, data=body, params=timeout)
+        return codec.decode(response)
+
+    async def modify(self, resource, rname=None, rid=None, timeout=None, **kwargs):
+        """
+        Coroutine version of Unity.modify()
+        """
+        if not rname and not rid:
+            print('No resource name or ID specified.')
+            return
+        endpoint = '{}/{}'.format(self._instance(resource, None if rid else rname, rid), 'action/modify')
+        timeout = Unity.timeout_params(timeout)
+        return await self._request('POST', endpoint, params=timeout, data=codec.dumps(kwargs))
+
+    async def delete(self, resource, rname=None, rid=None, timeout=None, **kwargs):
+        """
+        Coroutine version of Unity.delete()
+        """
+        if rname and rid:
+            print('You cannot specify a name and an ID.')
+            return
+        elif not rname and not rid:
+            print('No instance to given to delete.')
+            return
+        timeout = Unity.timeout_params(timeout)
+        endpoint = self._instance(resource, rname, rid)
+        return await self._request('DELETE', endpoint, params=timeout, data=codec.dumps(kwargs))
+
+    async def action(self, resource, action, rid: str = None, rname: str = None, **kwargs):
+        """
+        Coroutine version of Unity.action()
+        """
+        if rname and rid:
+            print('You cannot specify both a resource name and ID.')
+            return
+        elif rname or rid:
+            endpoint = '{}/{}'.format(self._instance(resource, rname, rid), 'action/{}'.format(action))
+        else:
+            endpoint = '{}/{}/{}/{}/{}'.format(self.url, 'api/types', resource, 'action', action)
+        return await self._request('POST', endpoint, data=codec.dumps(kwargs))
+
+    async def download(self, nasServerId: str, fileType: int):
+        """
+        Coroutine version of Unity.download()
+        :return: raw file in response body
+        """
+        endpoint = '{}/{}/{}/{}/{}'.format(self.url, 'download', fileType, 'nasServer', nasServerId)
+        response = await self._request('GET', endpoint)
+        return response.content
+
+    async def upload(self, nasServerId: str, fileType: int, filePath: str):
+        """
+        Coroutine version of Unity.upload()
+        :return: Response 200/204 for success
+        """
+        endpoint = '{}/{}/{}/{}/{}'.format(self.url, 'upload', fileType, 'nasServer', nasServerId)
+        for attempt in range(2):
+            token = self.headers.get('EMC-CSRF-TOKEN')
+            headers = {k: v for k, v in self.headers.items() if k != 'Content-Type'}
+            # The form is read as it is sent, so a retry opens the file again
+            with open(filePath, 'rb') as f:
+                form = aiohttp.FormData()
+                form.add_field('file', f)
+                async with self.session.post(endpoint, data=form, headers=headers) as response:
+                    answer = AsyncResponse(response.status, response.headers, await response.read())
+            if attempt or answer.status not in (401, 403) or not await self._relogin(token):
+                return answer
+
+
+class AsyncStorageResource:
+    def __init__(self, unity):
+        self.unity = unity
+
+    async def get(self, rid=None, rname=None, **kwargs):
+        if rname and rid:
+            print('You cannot specify a name and an ID.')
+            return
+        return await self.unity.get('storageResource', rname=rname, rid=rid, **kwargs)
+
+    async def create(self, resource, *args, timeout=None, **kwargs):
+        """
+        Coroutine version of storageResource.create()
+        """
+        action = 'create{}'.format(resource)
+        obj = classes.build(resource, *args, **kwargs)
+        if obj is None:
+            return
+        endpoint = '{}/{}/{}'.format(self.unity.url, 'api/types/storageResource/action', action)
+        timeout = Unity.timeout_params(timeout)
+        response = await self.unity._request('POST', endpoint, params=timeout, data=AsyncUnity.jsonify(obj))
+        return codec.decode(response)
+
+    async def delete(self, rid=None, rname=None, timeout=None, **kwargs):
+        return await self.unity.delete('storageResource', rname=rname, rid=rid, timeout=timeout, **kwargs)
@@ -0,0 +1,93 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class ResponseCache:
+
+    def __init__(self, ttl: float = 30, ttls: dict = None, max_entries: int = 1024):
+        """
+        In-memory cache for the results of Unity.get() queries.
+
+        Entries are keyed by (host, endpoint, query parameters), expire after
+        the TTL of their resource type and the least recently used entry is
+        evicted once 'max_entries' is reached.  Any create, modify, delete or
+        action on a resource type drops the cached entries of that type.
+
+        One cache can be shared by many Unity objects (see UnityFleet), since
+        the host is part of the key.
+
+        Example:
+
+            > nas = Unity('hostname', user, password, cache=ResponseCache(ttl=10, ttls={'job': 0}))
+
+        Cached results are shared between callers, so they must not be modified.
+
+        :param ttl: Default time to live of an entry, in seconds
+        :param ttls: Dictionary of resource type -> TTL for resources that need
+                     a different TTL.  A TTL of 0 disables caching for that type.
+        :param max_entries: Maximum number of entries kept
+        """
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def key(host, endpoint, params):
+        """
+        Builds the cache key of a query.  The parameters are normalized, so
+        the order they were given in does not matter.
+        """
+        return host, endpoint, tuple(sorted((k, str(v)) for k, v in params.items()))
+
+    def get(self, key):
+        """
+        :return: The cached result for the key, or None if there is no valid entry
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, resource, key, value):
+        """
+        Stores the result of a query on a resource type.
+        """
+        ttl = self.ttls.get(resource, self.ttl)
+        if not ttl:
+            return
+        with self.lock:
+            self.entries[key] = (resource, time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, resource=None, host=None):
+        """
+        Drops cached entries.
+        :param resource: Resource type to drop.  Everything is dropped if not given.
+        :param host: Only drop the entries of this host
+        """
+        with self.lock:
+            for key in [k for k, v in self.entries.items()
+                        if (resource is None or v[0] == resource) and (host is None or k[0] == host)]:
+                del self.entries[key]
+
+    def stats(self):
+        """
+        :return: Dictionary with the hit/miss counters and the number of entries
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries)}
@@ -1,3 +1,6 @@
+from unity import codec
+
+
 class IdObject(object):
     """
     This is a simple class, that is used for multiple objects.  Many
@@ -38,6 +41,30 @@ class OptObject(object):
     def __init__(self, **kwargs):
         self.__dict__.update(kwargs)
 
+
+def build(resource, *args, **kwargs):
+    """
+    Looks up the class for a resource in this module and instantiates it
+    with the given arguments.  This is the one place the payload objects
+    are built, so the Unity and AsyncUnity clients always send the same
+    thing.
+
+    :param resource: Name of the resource (must match the class name)
+    :return: The payload object, or None if there is no class for the resource
+    """
+    class_name = globals().get(resource)
+    if not isinstance(class_name, type):
+        print('Invalid resource name or class does not exist.')
+        return None
+    return class_name(*args, **kwargs)
+
+
+def jsonify(data):
+    """
+    Converts a payload object (and all nested objects) to compact JSON, as bytes.
+    """
+    return codec.dumps(data.__dict__)
+
 #####################################
 # Configuring network communication #
 #####################################
@@ -474,6 +501,16 @@ class kmipServer:
         self.username = username
         self.password = password
 
+
+class metricRealTimeQuery:
+    def __init__(self, paths: list, interval: int):
+        """
+        :param paths: Metric paths to collect (sp.*.cpu.summary.utilization...)
+        :param interval: Sampling interval, in seconds
+        """
+        self.paths = paths
+        self.interval = interval
+
 #######################
 # Managing the system #
 #######################
@@ -0,0 +1,51 @@
+"""
+JSON encoding and decoding of the API payloads.
+
+orjson is used when it is installed, the standard json module otherwise.
+Payloads are encoded compactly (no indentation), and responses are decoded
+straight from the bytes of the body, without building a str first.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def default(o):
+    """
+    Encodes the payload objects of classes.py (and their nested objects)
+    as their attributes.
+    """
+    return o.__dict__
+
+
+if orjson is not None:
+    name = 'orjson'
+
+    def dumps(data):
+        """
+        :return: JSON encoding of data, as bytes
+        """
+        return orjson.dumps(data, default=default)
+
+    loads = orjson.loads
+else:
+    name = 'json'
+    encoder = json.JSONEncoder(default=default, separators=(',', ':'), ensure_ascii=False)
+
+    def dumps(data):
+        """
+        :return: JSON encoding of data, as bytes
+        """
+        return encoder.encode(data).encode('utf-8')
+
+    loads = json.loads
+
+
+def decode(response):
+    """
+    Decodes the JSON body of a requests response.
+    """
+    return loads(response.content)
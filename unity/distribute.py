@@ -0,0 +1,118 @@
+"""
+Distribution of the same configuration file (Hosts, Netgroups,
+Username_Mappings...) to many NAS servers on many arrays.
+
+The file is read once into memory and uploaded to all the targets
+concurrently, with a cap on the uploads in flight per array so a big push
+does not flood one system.  Each target can then be verified by
+downloading the file back and comparing its hash:
+
+    > results = distribute([(fleet['unity01'], 'nas_1'), (fleet['unity02'], 'nas_7')],
+    >                      7, '/srv/config/hosts', verify=True)
+    > print(report(results))
+"""
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import itertools
+import os
+import threading
+import time
+
+# Outcome of the distribution to one NAS server.  'verified' is None when
+# the file was not downloaded back (or the download failed), 'error' is
+# None when all went well.
+DistributionResult = namedtuple('DistributionResult', ('array', 'nasServer', 'status', 'bytes', 'verified',
+                                                       'error', 'elapsed'))
+
+
+class Discard:
+    """
+    File object throwing away what is written to it (downloads that are only hashed).
+    """
+    def write(self, data):
+        return len(data)
+
+
+def interleave(targets):
+    """
+    Orders the targets round robin across the arrays, so the workers are
+    spread over all the arrays instead of queuing on the first one.
+    """
+    groups = OrderedDict()
+    for target in targets:
+        groups.setdefault(target[0].name, []).append(target)
+    return [t for group in itertools.zip_longest(*groups.values()) for t in group if t is not None]
+
+
+def distribute(targets, fileType: int, source, fleet=None, per_array: int = 4, workers: int = 32,
+               verify: bool = False, checksum: str = 'sha256', filename: str = None, resolve: bool = False):
+    """
+    Uploads one file to many NAS servers.
+
+    :param targets: List of (array, nasServerId).  The array is a connected
+                    Unity object, or the name of an array of 'fleet'.
+    :param fileType: Type of configuration file (see Unity.upload(): 3 -
+                     Username_Mappings, 7 - Hosts, 8 - Netgroups...)
+    :param source: Path of the file, or its content as bytes
+    :param fleet: UnityFleet the array names are looked up in (optional)
+    :param per_array: Maximum number of uploads in flight per array
+    :param workers: Maximum number of uploads in flight overall
+    :param verify: Download the file back from every NAS server and compare its hash
+    :param checksum: hashlib algorithm used to verify the files
+    :param filename: Name of the file in the form (defaults to the name of the path)
+    :param resolve: Accept NAS server names instead of IDs (see resolver.py)
+    :return: List of DistributionResult, in the order of the targets
+    """
+    if isinstance(source, (str, os.PathLike)):
+        filename = filename or os.path.basename(source)
+        with open(source, 'rb') as f:
+            data = f.read()
+    else:
+        data = bytes(source)
+    expected = hashlib.new(checksum, data).hexdigest()
+
+    targets = [(fleet[array] if isinstance(array, str) else array, nas, i)
+               for i, (array, nas) in enumerate(targets)]
+    caps = {array.name: threading.Semaphore(per_array) for array, nas, i in targets}
+
+    def push(target):
+        array, nas, i = target
+        with caps[array.name]:
+            start = time.monotonic()
+            try:
+                if resolve:
+                    nas = array.resolver.resolve('nasServer', nas)
+                sent = array.upload_from(nas, fileType, data, filename=filename)
+                if sent.status not in (200, 201, 204):
+                    return i, DistributionResult(array.name, nas, sent.status, sent.bytes, None,
+                                                 'Upload refused', time.monotonic() - start)
+                verified, error = None, None
+                if verify:
+                    received = array.download_to(nas, fileType, Discard(), checksum=checksum)
+                    if received.status != 200 or received.checksum is None:
+                        error = 'Verification download failed ({})'.format(received.status)
+                    else:
+                        verified = received.checksum == expected
+                        error = None if verified else 'Downloaded file does not match'
+                return i, DistributionResult(array.name, nas, sent.status, sent.bytes, verified, error,
+                                             time.monotonic() - start)
+            except Exception as e:
+                return i, DistributionResult(array.name, nas, None, 0, None, e, time.monotonic() - start)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(targets)))) as pool:
+        results = dict(pool.map(push, interleave(targets)))
+    return [results[i] for i in range(len(targets))]
+
+
+def report(results):
+    """
+    :return: The results of distribute() as a text table
+    """
+    lines = ['{:<20} {:<12} {:>6} {:>10} {:>8} {:>8}  {}'.format('array', 'nasServer', 'status', 'bytes',
+                                                                 'verified', 'seconds', 'error')]
+    for r in results:
+        verified = '-' if r.verified is None else 'yes' if r.verified else 'NO'
+        lines.append('{:<20} {:<12} {:>6} {:>10} {:>8} {:>8.2f}  {}'.format(
+            r.array, r.nasServer, r.status or '-', r.bytes, verified, r.elapsed, r.error or ''))
+    return '\n'.join(lines)
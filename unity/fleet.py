@@ -0,0 +1,175 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import threading
+import time
+from unity.unity import Unity
+
+# Outcome of one operation on one array of the fleet.  Exactly one of
+# 'result' and 'error' is set ('error' holds the exception raised, or the
+# error returned by the API).  'elapsed' is in seconds.
+FleetResult = namedtuple('FleetResult', ('name', 'result', 'error', 'elapsed'))
+
+
+class UnityFleet:
+
+    def __init__(self, arrays, user=None, password=None, workers: int = None, **kwargs):
+        """
+        A group of Unity systems that are connected and queried together.
+
+        Every fleet operation runs on all arrays in parallel, so a query
+        across the whole fleet takes about as long as the slowest array
+        instead of the sum of all of them.
+
+        Example:
+
+            > fleet = UnityFleet(['unity01', 'unity02', 'unity03'], 'admin', password)
+            > fleet.connect()
+            > pools = fleet.get('pool', fields='name,sizeTotal,sizeUsed')
+            > for name, res in pools.items():
+            >     print(name, res.error or res.result)
+
+        :param arrays: List of names/IPs of the Unity systems.  Unity objects
+                       can be given too, if they need their own credentials.
+        :param user: Username to log in with
+        :param password: Password to log in with
+        :param workers: Maximum number of arrays to talk to at once.
+                        Defaults to one thread per array.
+        :param kwargs: Other arguments for the Unity objects (cache, transport,
+                       session_store...), shared by all arrays
+        """
+        self.user = user
+        self.password = password
+        self.workers = workers
+        self.options = kwargs
+        self.arrays = {}
+        for array in arrays:
+            self.add(array)
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __iter__(self):
+        return iter(self.arrays.values())
+
+    def __len__(self):
+        return len(self.arrays)
+
+    def add(self, array):
+        """
+        Adds an array to the fleet.
+        :param array: Name/IP of the Unity system, or a Unity object
+        :return: The Unity object for the array
+        """
+        if not isinstance(array, Unity):
+            array = Unity(array, self.user, self.password, **self.options)
+        self.arrays[array.name] = array
+        return array
+
+    def map(self, func, *args, timeout: float = None, **kwargs):
+        """
+        Calls func(unity, *args, **kwargs) for every array in parallel.
+
+        Exceptions are captured per array, so one unreachable array does
+        not abort the whole operation.  Error answers of the API (the
+        {'error': ...} dictionaries returned by get(), create()...) are
+        reported as errors too.  Arrays that have not answered within
+        'timeout' seconds of the start of their call are reported with a
+        TimeoutError; arrays waiting for a worker are not timed meanwhile.
+
+        :param func: Function taking a Unity object as its first argument
+        :param timeout: Seconds to wait for each array (optional)
+        :return: Dictionary of array name -> FleetResult
+        """
+        results = {}
+        if not self.arrays:
+            return results
+        # A thread per array, with at most 'workers' of them calling at once.
+        # The slot of an array that timed out is given back right away, so
+        # a hung array does not hold up the arrays queued behind it.
+        slots = threading.Semaphore(self.workers or len(self.arrays))
+        lock = threading.Lock()
+        started = {}
+        released = set()
+
+        def release(name):
+            with lock:
+                if name not in released:
+                    released.add(name)
+                    slots.release()
+
+        def call(array):
+            slots.acquire()
+            start = time.monotonic()
+            with lock:
+                started[array.name] = start
+            try:
+                result = func(array, *args, **kwargs)
+                if isinstance(result, dict) and 'error' in result:
+                    return FleetResult(array.name, None, result['error'], time.monotonic() - start)
+                return FleetResult(array.name, result, None, time.monotonic() - start)
+            except Exception as e:
+                return FleetResult(array.name, None, e, time.monotonic() - start)
+            finally:
+                release(array.name)
+
+        pool = ThreadPoolExecutor(max_workers=len(self.arrays))
+        futures = {pool.submit(call, array): name for name, array in self.arrays.items()}
+        pending = set(futures)
+        while pending:
+            wait_for = None
+            if timeout is not None:
+                now = time.monotonic()
+                with lock:
+                    starts = {future: started.get(futures[future]) for future in pending}
+                for future, start in starts.items():
+                    if start is not None and now - start >= timeout and not future.done():
+                        name = futures[future]
+                        error = TimeoutError('No answer from {} within {} seconds'.format(name, timeout))
+                        results[name] = FleetResult(name, None, error, timeout)
+                        pending.discard(future)
+                        release(name)
+                # Calls starting after this point cannot expire before the next check
+                deadlines = [start + timeout - now for future, start in starts.items()
+                             if start is not None and future in pending]
+                wait_for = max(0, min(deadlines + [timeout]))
+            if not pending:
+                break
+            done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                results[futures[future]] = future.result()
+        pool.shutdown(wait=False, cancel_futures=True)
+        return {name: results[name] for name in self.arrays if name in results}
+
+    def connect(self, timeout: float = None):
+        """
+        Logs into every array of the fleet concurrently.
+        :return: Dictionary of array name -> FleetResult with the login query
+        """
+        return self.map(Unity.connect, timeout=timeout)
+
+    def disconnect(self, timeout: float = None):
+        """
+        Logs out of every connected array of the fleet.
+        """
+        return self.map(lambda array: array.disconnect() if array.session else None, timeout=timeout)
+
+    def get(self, resource, rname=None, rid=None, timeout: float = None, **kwargs):
+        """
+        Runs the same get() query on every array in parallel.  See Unity.get()
+        for the parameters.
+        :param timeout: Seconds to wait for each array (optional)
+        :return: Dictionary of array name -> FleetResult
+        """
+        return self.map(Unity.get, resource, rname=rname, rid=rid, timeout=timeout, **kwargs)
+
+    def collect(self, resource, timeout: float = None, **kwargs):
+        """
+        Reads a whole collection (all pages) from every array in parallel.
+        See Unity.iter() for the parameters.
+        :param timeout: Seconds to wait for each array (optional)
+        :return: Dictionary of array name -> FleetResult with a list of entries.
+                 An array whose listing failed on any page gets the error,
+                 not a partial list.
+        """
+        return self.map(lambda array: list(array.iter(resource, raise_errors=True, **kwargs)), timeout=timeout)
@@ -0,0 +1,259 @@
+"""
+Local SQLite snapshot of the instances of one or more Unity systems.
+
+Questions like "which filesystems on nas_3 are over 80%" are answered from
+the snapshot instead of re-querying the arrays:
+
+    > inventory = Inventory('inventory.db')
+    > inventory.sync(nas)
+    > inventory.query('filesystem', "json_extract(content, '$.sizeUsed') > "
+    >                 "0.8 * json_extract(content, '$.sizeTotal')", host='nas_3')
+
+Every instance is one row of the 'instances' table, with its content as
+JSON and the columns that are queried the most (name, pool, nasServer,
+storageResource) copied out and indexed.
+
+Resyncs are incremental.  The Unity API has no modification timestamp
+common to all resources, so each resource type names a few cheap 'updated'
+fields that change when the instance changes.  Only those are read for the
+whole collection; the instances whose values differ from the snapshot are
+then fetched with all their fields, by chunks of IDs, and the instances that
+disappeared are deleted.  Resource types without 'updated' fields are read
+in full, but only the rows that changed are written.
+"""
+from collections import namedtuple
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from unity import codec
+from unity.fleet import UnityFleet
+from unity.jobs import in_filter
+
+# Fields and 'updated' fields of the resource types synced by default.
+# 'updated' fields are read for every instance on each sync, so they must be
+# cheap; None means the whole collection is read on each sync.
+RESOURCES = {
+    'pool': {'fields': 'name,sizeTotal,sizeUsed,sizeFree,sizeSubscribed', 'updated': None},
+    'nasServer': {'fields': 'name,pool,homeSP,currentSP,health', 'updated': None},
+    'filesystem': {'fields': 'name,pool,nasServer,storageResource,sizeTotal,sizeUsed,sizeAllocated,health',
+                   'updated': 'name,sizeTotal,sizeUsed,sizeAllocated'},
+    'lun': {'fields': 'name,pool,storageResource,sizeTotal,sizeAllocated,health',
+            'updated': 'name,sizeTotal,sizeAllocated'},
+    'nfsShare': {'fields': 'name,path,filesystem,storageResource', 'updated': None},
+    'cifsShare': {'fields': 'name,path,filesystem,storageResource', 'updated': None},
+    'snap': {'fields': 'name,storageResource,creationTime,expirationTime,size',
+             'updated': 'name,expirationTime'},
+}
+
+# Columns copied out of the content of the instances, and indexed
+KEYS = ('name', 'pool', 'nasServer', 'storageResource')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS instances (
+    host TEXT NOT NULL,
+    resource TEXT NOT NULL,
+    id TEXT NOT NULL,
+    name TEXT,
+    pool TEXT,
+    nasServer TEXT,
+    storageResource TEXT,
+    version TEXT,
+    digest TEXT,
+    content TEXT NOT NULL,
+    PRIMARY KEY (host, resource, id)
+);
+CREATE INDEX IF NOT EXISTS instances_name ON instances (resource, name);
+CREATE INDEX IF NOT EXISTS instances_pool ON instances (pool);
+CREATE INDEX IF NOT EXISTS instances_nasServer ON instances (nasServer);
+CREATE INDEX IF NOT EXISTS instances_storageResource ON instances (storageResource);
+CREATE TABLE IF NOT EXISTS syncs (
+    host TEXT NOT NULL,
+    resource TEXT NOT NULL,
+    fields TEXT NOT NULL,
+    synced REAL NOT NULL,
+    PRIMARY KEY (host, resource)
+);
+"""
+
+# Outcome of the sync of one resource type of one system
+SyncResult = namedtuple('SyncResult', ('host', 'resource', 'added', 'changed', 'removed', 'unchanged',
+                                       'error', 'elapsed'))
+
+
+def reference(value):
+    """
+    :return: The ID of a reference ({'id': 'pool_1'}), or the value itself
+    """
+    if type(value) is dict:
+        return value.get('id')
+    return value
+
+
+def digest(content, fields):
+    """
+    :return: Digest of the given fields of the content of an instance
+    """
+    return hashlib.sha1(codec.dumps([content.get(f) for f in fields])).hexdigest()
+
+
+class Inventory:
+
+    def __init__(self, path: str = 'inventory.db', resources: dict = None, chunk: int = 100):
+        """
+        :param path: Path of the SQLite database (':memory:' for a throwaway one)
+        :param resources: Dictionary of resource type -> {'fields': ..., 'updated': ...}
+                          to sync.  Defaults to RESOURCES.
+        :param chunk: Maximum number of IDs per query when fetching the
+                      instances that changed
+        """
+        if path != ':memory:':
+            path = os.path.expanduser(path)
+        self.path = path
+        self.resources = resources or RESOURCES
+        self.chunk = chunk
+        self.lock = threading.Lock()
+        # One connection, shared (under the lock) by the threads of a fleet sync
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.lock, self.db:
+            self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def sync(self, unity, resources=None):
+        """
+        Brings the snapshot of a system (or of every system of a UnityFleet)
+        up to date.  Systems of a fleet are synced in parallel.
+
+        :param unity: A connected Unity object, or a UnityFleet
+        :param resources: Resource types to sync (defaults to all of self.resources)
+        :return: List of SyncResult
+        """
+        if isinstance(unity, UnityFleet):
+            results = []
+            for name, res in unity.map(self.sync, resources).items():
+                if res.error:
+                    results.append(SyncResult(name, None, 0, 0, 0, 0, res.error, res.elapsed))
+                else:
+                    results.extend(res.result)
+            return results
+        return [self.sync_resource(unity, resource) for resource in resources or self.resources]
+
+    def sync_resource(self, unity, resource):
+        """
+        Syncs one resource type of one system.
+        :return: SyncResult
+        """
+        start = time.monotonic()
+        spec = self.resources[resource]
+        fields = spec['fields']
+        updated = spec.get('updated')
+        host = unity.name
+        with self.lock:
+            stored = {row['id']: (row['version'], row['digest']) for row in self.db.execute(
+                'SELECT id, version, digest FROM instances WHERE host = ? AND resource = ?', (host, resource))}
+            row = self.db.execute('SELECT fields FROM syncs WHERE host = ? AND resource = ?',
+                                  (host, resource)).fetchone()
+        # The snapshot is of no use if it was taken with other fields
+        if row is not None and row['fields'] != fields:
+            stored = {rid: (None, None) for rid in stored}
+
+        try:
+            if updated:
+                versions = {}
+                names = updated.split(',')
+                for entry in unity.iter(resource, fields=updated, raise_errors=True):
+                    versions[entry['content']['id']] = digest(entry['content'], names)
+                wanted = [rid for rid, version in versions.items() if stored.get(rid, (None,))[0] != version]
+                entries = []
+                for i in range(0, len(wanted), self.chunk):
+                    ids = in_filter('id', wanted[i:i + self.chunk])
+                    entries.extend(unity.iter(resource, fields=fields, filter=ids, raise_errors=True))
+                present = set(versions)
+            else:
+                versions = {}
+                entries = list(unity.iter(resource, fields=fields, raise_errors=True))
+                present = {entry['content']['id'] for entry in entries}
+        except Exception as e:
+            return SyncResult(host, resource, 0, 0, 0, 0, e, time.monotonic() - start)
+
+        names = fields.split(',')
+        rows = []
+        added = changed = 0
+        for entry in entries:
+            content = entry['content']
+            rid = content['id']
+            content_digest = digest(content, names)
+            if rid in stored:
+                if stored[rid] == (versions.get(rid), content_digest):
+                    continue
+                changed += 1
+            else:
+                added += 1
+            rows.append((host, resource, rid) + tuple(reference(content.get(k)) for k in KEYS) +
+                        (versions.get(rid), content_digest, codec.dumps(content).decode('utf-8')))
+        removed = [(host, resource, rid) for rid in stored if rid not in present]
+
+        with self.lock, self.db:
+            self.db.executemany('INSERT OR REPLACE INTO instances VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self.db.executemany('DELETE FROM instances WHERE host = ? AND resource = ? AND id = ?', removed)
+            self.db.execute('INSERT OR REPLACE INTO syncs VALUES (?, ?, ?, ?)', (host, resource, fields, time.time()))
+        unchanged = len(present) - added - changed
+        return SyncResult(host, resource, added, changed, len(removed), unchanged, None, time.monotonic() - start)
+
+    def query(self, resource, where: str = None, params=(), host: str = None):
+        """
+        Reads instances from the snapshot.
+
+        Example:
+
+            > inventory.query('filesystem', 'pool = ?', ('pool_1',))
+            > inventory.query('filesystem', "json_extract(content, '$.sizeUsed') > 1e12")
+
+        :param resource: Resource type
+        :param where: SQL condition on the columns of the 'instances' table
+                      (name, pool, nasServer, storageResource, content)
+        :param params: Parameters of the condition
+        :param host: Only return the instances of this system
+        :return: List of content dictionaries, with the 'host' they are on
+        """
+        sql = 'SELECT host, content FROM instances WHERE resource = ?'
+        args = [resource]
+        if host:
+            sql += ' AND host = ?'
+            args.append(host)
+        if where:
+            sql += ' AND ({})'.format(where)
+            args.extend(params)
+        with self.lock:
+            rows = self.db.execute(sql, args).fetchall()
+        return [dict(codec.loads(row['content']), host=row['host']) for row in rows]
+
+    def get(self, resource, rname: str = None, rid: str = None, host: str = None):
+        """
+        Finds one instance by name or ID in the snapshot.
+        :return: The content dictionary, or None
+        """
+        if rid:
+            found = self.query(resource, 'id = ?', (rid,), host)
+        else:
+            found = self.query(resource, 'name = ?', (rname,), host)
+        return found[0] if found else None
+
+    def synced(self, host: str = None):
+        """
+        :return: Dictionary of (host, resource) -> time of the last sync (epoch)
+        """
+        sql = 'SELECT host, resource, synced FROM syncs'
+        with self.lock:
+            rows = self.db.execute(sql + ' WHERE host = ?', (host,)) if host else self.db.execute(sql)
+            return {(row['host'], row['resource']): row['synced'] for row in rows}
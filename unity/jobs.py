@@ -0,0 +1,332 @@
+import time
+from unity import classes, codec
+
+# JobStateEnum values of the 'job' resource
+QUEUED = 1
+RUNNING = 2
+SUSPENDED = 3
+COMPLETED = 4
+FAILED = 5
+ROLLING_BACK = 6
+COMPLETED_WITH_PROBLEMS = 7
+FINISHED = {COMPLETED, FAILED, COMPLETED_WITH_PROBLEMS}
+
+
+def in_filter(field, values):
+    """
+    Builds a filter matching any of the given values, like:
+        id in ("N-1","N-2")
+    """
+    return '{} in ({})'.format(field, ','.join('"{}"'.format(v) for v in values))
+
+
+class Job:
+    """
+    Lightweight handle on a job running on a Unity system.  It is returned by
+    the *_async functions of Unity and storageResource, and updated in place
+    by a JobWaiter.
+    """
+    __slots__ = ('unity', 'id', 'state', 'progress', 'message', 'tasks', 'error')
+
+    def __init__(self, unity, jobId, error=None):
+        """
+        :param unity: The Unity (or storageResource) object the job was submitted with
+        :param jobId: ID of the job (N-123)
+        :param error: Error returned when submitting, if the job was not started
+        """
+        self.unity = unity
+        self.id = jobId
+        self.state = FAILED if error else QUEUED
+        self.progress = 0
+        self.message = None
+        self.tasks = []
+        self.error = error
+
+    def __repr__(self):
+        return '<Job {} state={} progress={}>'.format(self.id, self.state, self.progress)
+
+    @classmethod
+    def submitted(cls, unity, answer):
+        """
+        Builds the handle from the answer to an asynchronous request, which
+        is the ID of the job: {'id': 'N-123'}.  Takes the parsed answer or
+        the response object.
+        """
+        if answer is None:
+            return cls(unity, None, error='The request was not sent')
+        if hasattr(answer, 'content'):
+            answer = codec.decode(answer) if answer.content else {}
+        if 'error' in answer:
+            return cls(unity, None, error=answer['error'])
+        jobId = answer.get('id') or answer.get('content', {}).get('id')
+        return cls(unity, jobId, error=None if jobId else 'No job ID in the answer: {}'.format(answer))
+
+    @property
+    def done(self):
+        return self.state in FINISHED
+
+    @property
+    def ok(self):
+        return self.state == COMPLETED
+
+    @property
+    def result(self):
+        """
+        Output parameters of the last task of the job (usually the ID of
+        what was created), once it completed.
+        """
+        for task in reversed(self.tasks):
+            if task.get('parametersOut'):
+                return task['parametersOut']
+        return None
+
+    def update(self, content):
+        """
+        Updates the handle from the content of a 'job' instance.
+        """
+        self.state = content.get('state', self.state)
+        self.progress = content.get('progressPct', self.progress)
+        self.tasks = content.get('tasks', self.tasks)
+        message = content.get('messageOut')
+        if message:
+            self.message = message.get('messages', message) if isinstance(message, dict) else message
+        if self.state == FAILED and self.error is None:
+            self.error = self.message or 'Job failed'
+
+    def wait(self, interval: float = 5, timeout: float = None):
+        """
+        Blocks until the job is finished.
+        :return: The job
+        """
+        JobWaiter([self], interval=interval).wait(timeout=timeout)
+        return self
+
+
+class JobWaiter:
+
+    fields = 'id,state,progressPct,messageOut,tasks'
+
+    def __init__(self, jobs=None, interval: float = 5, chunk: int = 100, missing: int = 3):
+        """
+        Waits for many jobs at once.  Instead of one GET per job, every poll
+        is one 'job' collection query per system, filtered on the IDs of the
+        jobs still running:
+
+            filter=id in ("N-1","N-2",...)
+
+        Example:
+
+            > waiter = JobWaiter(interval=10)
+            > for name in names:
+            >     waiter.add(nas.storageResource.create_async('Filesystem', name, 'pool_1', 'nas_1', '5G'))
+            > for job in waiter.as_completed():
+            >     print(job.id, job.ok, job.result)
+
+        :param jobs: Jobs to wait for (more can be added with add())
+        :param interval: Seconds between two polls
+        :param chunk: Maximum number of job IDs in one query
+        :param missing: Number of polls in a row a job can be absent from the
+                        answer (deleted, or a wrong ID) before it is marked
+                        as failed with a LookupError
+        """
+        self.interval = interval
+        self.chunk = chunk
+        self.missing = missing
+        self.absent = {}
+        self.jobs = []
+        for job in jobs or []:
+            self.add(job)
+
+    def add(self, job):
+        self.jobs.append(job)
+        return job
+
+    @property
+    def pending(self):
+        return [job for job in self.jobs if not job.done]
+
+    def poll(self):
+        """
+        Queries the state of all pending jobs.
+        :return: List of the jobs that finished since the last poll
+        """
+        by_system = {}
+        for job in self.pending:
+            by_system.setdefault((job.unity.url, id(job.unity)), []).append(job)
+        finished = []
+        for jobs in by_system.values():
+            unity = jobs[0].unity
+            endpoint = '{}/{}'.format(unity.url, 'api/types/job/instances')
+            for start in range(0, len(jobs), self.chunk):
+                chunk = {job.id: job for job in jobs[start:start + self.chunk]}
+                params = {
+                    'fields': self.fields,
+                    'filter': in_filter('id', chunk),
+                    'per_page': len(chunk)
+                }
+                answer = codec.decode(unity.session.get(endpoint, params=params))
+                if 'error' in answer:
+                    print('Job query on {} failed: {}'.format(unity.name, answer['error']))
+                    continue
+                seen = set()
+                for entry in answer.get('entries', []):
+                    job = chunk.get(entry['content'].get('id'))
+                    if job is not None:
+                        seen.add(job.id)
+                        self.absent.pop(job.id, None)
+                        job.update(entry['content'])
+                        if job.done:
+                            finished.append(job)
+                for jobId, job in chunk.items():
+                    if jobId in seen:
+                        continue
+                    self.absent[jobId] = self.absent.get(jobId, 0) + 1
+                    if self.absent[jobId] >= self.missing:
+                        job.state = FAILED
+                        job.error = LookupError('Job {} not found on {}'.format(jobId, unity.name))
+                        finished.append(job)
+        return finished
+
+    def as_completed(self, timeout: float = None):
+        """
+        Generator yielding the jobs as they finish.  Jobs that failed to
+        start are yielded right away.
+        :param timeout: Seconds to wait for all jobs.  Stops silently when reached.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for job in self.jobs:
+            if job.id is None:
+                yield job
+        while self.pending:
+            for job in self.poll():
+                yield job
+            if not self.pending or (deadline is not None and time.monotonic() >= deadline):
+                return
+            time.sleep(self.interval)
+
+    def wait(self, timeout: float = None):
+        """
+        Blocks until all jobs are finished, or the timeout is reached.
+        :return: The list of jobs
+        """
+        for _ in self.as_completed(timeout=timeout):
+            pass
+        return self.jobs
+
+
+class Batch:
+
+    def __init__(self, unity, description: str = '', wait: bool = True, interval: float = 5):
+        """
+        Records create/modify/delete/action calls as the tasks of a single
+        job, and submits them in one request when the 'with' block ends.
+        Use Unity.batch() to get one.
+
+        Every call returns a reference to the ID the task will produce
+        ('@task2.id'), which can be given to later calls of the batch in
+        place of an ID:
+
+            > with nas.batch('New tenant') as b:
+            >     ns = b.create('nasServer', 'nas_t1', 'spa', 'pool_1')
+            >     b.create('fileInterface', ns, 'spa_eth2', '10.0.0.10', netmask='255.255.255.0')
+            >     b.create('nfsServer', ns)
+            >     fs = b.storageResource.create('Filesystem', 'fs_t1', 'pool_1', ns, '100G')
+            > b.job.ok
+
+        Nothing is sent if the block raises an exception.
+
+        :param unity: The Unity object to submit the job with
+        :param description: Description of the job
+        :param wait: Wait for the job to finish when the block ends
+        :param interval: Seconds between two polls while waiting
+        """
+        self.unity = unity
+        self.description = description
+        self.wait = wait
+        self.interval = interval
+        self.tasks = []
+        self.job = None
+        self.storageResource = BatchStorageResource(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None and self.tasks:
+            self.submit()
+        return False
+
+    def add(self, resource, action, parameters):
+        """
+        Adds a task to the job.
+        :param resource: Type of the resource the task runs on
+        :param action: Name of the action (create, modify, delete, createFilesystem...)
+        :param parameters: Dictionary of input parameters
+        :return: Reference to the ID produced by the task
+        """
+        name = 'task{}'.format(len(self.tasks) + 1)
+        self.tasks.append({'name': name, 'object': resource, 'action': action, 'parametersIn': parameters})
+        return '@{}.id'.format(name)
+
+    def create(self, resource, *args, **kwargs):
+        """
+        Records a create.  Takes the same arguments as Unity.create()
+        :return: Reference to the ID of the created instance
+        """
+        obj = classes.build(resource, *args, **kwargs)
+        if obj is None:
+            return
+        return self.add(resource, 'create', codec.loads(classes.jsonify(obj)))
+
+    def modify(self, resource, rid, **kwargs):
+        """
+        Records a modify of an instance (by ID, or a reference from this batch).
+        """
+        return self.add(resource, 'modify', dict(kwargs, id=rid))
+
+    def delete(self, resource, rid, **kwargs):
+        """
+        Records a delete of an instance (by ID, or a reference from this batch).
+        """
+        return self.add(resource, 'delete', dict(kwargs, id=rid))
+
+    def action(self, resource, action, rid: str = None, **kwargs):
+        """
+        Records an action on a resource type, or on an instance if rid is given.
+        """
+        if rid:
+            kwargs['id'] = rid
+        return self.add(resource, action, kwargs)
+
+    def submit(self):
+        """
+        Sends all the recorded tasks as one job.  Called when the 'with' block ends.
+        :return: The Job
+        """
+        body = classes.jsonify(classes.build('job', self.description, self.tasks))
+        endpoint = '{}/{}'.format(self.unity.url, 'api/types/job/instances')
+        response = self.unity.session.post(endpoint, data=body, params={'timeout': 0})
+        self.job = Job.submitted(self.unity, response)
+        for resource in {task['object'] for task in self.tasks}:
+            self.unity.invalidate(resource)
+        if self.wait and self.job.id:
+            self.job.wait(interval=self.interval)
+        return self.job
+
+
+class BatchStorageResource:
+    def __init__(self, batch):
+        self.batch = batch
+
+    def create(self, resource, *args, **kwargs):
+        """
+        Records the creation of a storage resource.  Same arguments as storageResource.create()
+        :return: Reference to the ID of the storage resource
+        """
+        obj = classes.build(resource, *args, **kwargs)
+        if obj is None:
+            return
+        return self.batch.add('storageResource', 'create{}'.format(resource), codec.loads(classes.jsonify(obj)))
+
+    def delete(self, rid, **kwargs):
+        return self.batch.add('storageResource', 'delete', dict(kwargs, id=rid))
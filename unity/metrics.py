@@ -0,0 +1,339 @@
+"""
+Performance metrics (IOPS, bandwidth, latency, CPU...) of a Unity system.
+
+Real-time metrics are collected by a metricRealTimeQuery on the array.
+Metrics.stream() creates the query, polls its metricQueryResult entries at
+the query interval and yields the samples as flat tuples:
+
+    > for sample in nas.metrics.stream(['sp.*.cpu.summary.utilization',
+    >                                   'sp.*.storage.filesystem.*.readsRate'], interval=5):
+    >     print(sample.timestamp, sample.path, sample.object, sample.value)
+
+The object of a sample is the path of the value in the 'values' of the
+result, joined with dots: 'spa' for an SP metric, 'spa.fs_1' for a
+filesystem metric.  The query is deleted when the generator is closed.
+
+Historical values (metricValue) are read with Metrics.history(), straight
+into packed arrays of timestamps and float64 values, one Series per object:
+
+    > latency = nas.metrics.history(['sp.*.storage.filesystem.*.readsRate'],
+    >                               start=time.time() - 30 * 86400, step=3600)
+    > series = latency['sp.*.storage.filesystem.*.readsRate']['spa.fs_1']
+    > series.timestamps, series.values
+"""
+from array import array
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import functools
+import math
+import queue
+import threading
+import time
+
+from unity.table import load_numpy
+
+# One value of a metric, at a time (seconds since the epoch)
+Sample = namedtuple('Sample', ('timestamp', 'path', 'object', 'value'))
+
+
+@functools.lru_cache(maxsize=4096)
+def timestamp(text):
+    """
+    Converts a timestamp of the API ('2016-06-20T20:13:00.000Z') to seconds
+    since the epoch.  All the values of a result share their timestamp, so
+    the conversions are cached.
+    """
+    text = text.rstrip('Z')
+    fmt = '%Y-%m-%dT%H:%M:%S.%f' if '.' in text else '%Y-%m-%dT%H:%M:%S'
+    return datetime.strptime(text, fmt).replace(tzinfo=timezone.utc).timestamp()
+
+
+def isoformat(when):
+    """
+    Formats a time (seconds since the epoch, datetime or string) for a filter
+    on the timestamps of the API.
+    """
+    if isinstance(when, str):
+        return when
+    if isinstance(when, datetime):
+        when = when.timestamp()
+    return datetime.fromtimestamp(when, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+def flatten(values, prefix=None):
+    """
+    Yields (object, value) for every number of the nested 'values' of a
+    metric result: {'spa': {'fs_1': 1.5}} -> ('spa.fs_1', 1.5)
+    """
+    for key, value in values.items():
+        name = key if prefix is None else prefix + '.' + key
+        if type(value) is dict:
+            yield from flatten(value, name)
+        else:
+            yield name, value
+
+
+class Series:
+    """
+    Time series of one metric of one object: timestamps (seconds since the
+    epoch) and values, as packed float64 arrays.
+    """
+    __slots__ = ('timestamps', 'values')
+
+    def __init__(self, timestamps=None, values=None):
+        self.timestamps = timestamps if timestamps is not None else array('d')
+        self.values = values if values is not None else array('d')
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __repr__(self):
+        return '<Series {} samples>'.format(len(self))
+
+    def append(self, when, value):
+        self.timestamps.append(when)
+        self.values.append(math.nan if value is None else value)
+
+    def sort(self):
+        """
+        Puts the samples in time order (pages may come back in any order).
+        """
+        if any(a > b for a, b in zip(self.timestamps, self.timestamps[1:])):
+            pairs = sorted(zip(self.timestamps, self.values))
+            self.timestamps = array('d', (t for t, v in pairs))
+            self.values = array('d', (v for t, v in pairs))
+        return self
+
+    def downsample(self, step: float, how: str = 'mean'):
+        """
+        Aggregates the samples into buckets of 'step' seconds.
+        :param step: Size of the buckets, in seconds
+        :param how: 'mean', 'min', 'max' or 'last'
+        :return: New Series, with one sample per bucket (at the start of the bucket)
+        """
+        numpy = load_numpy()
+        if numpy is not None and len(self):
+            times = numpy.frombuffer(self.timestamps)
+            values = numpy.frombuffer(self.values)
+            buckets = numpy.floor(times / step) * step
+            starts, inverse = numpy.unique(buckets, return_inverse=True)
+            if how == 'last':
+                result = numpy.empty(len(starts))
+                result[inverse] = values
+            elif how in ('min', 'max'):
+                result = numpy.full(len(starts), numpy.inf if how == 'min' else -numpy.inf)
+                getattr(numpy, how + 'imum').at(result, inverse, values)
+            else:
+                result = numpy.bincount(inverse, values) / numpy.bincount(inverse)
+            return Series(array('d', starts.tobytes()), array('d', result.tobytes()))
+        buckets = {}
+        for when, value in zip(self.timestamps, self.values):
+            buckets.setdefault(math.floor(when / step) * step, []).append(value)
+        series = Series()
+        for start in sorted(buckets):
+            values = buckets[start]
+            if how == 'last':
+                series.append(start, values[-1])
+            elif how in ('min', 'max'):
+                series.append(start, min(values) if how == 'min' else max(values))
+            else:
+                series.append(start, sum(values) / len(values))
+        return series
+
+    def to_numpy(self):
+        """
+        :return: (timestamps, values) as NumPy arrays sharing the memory of the series
+        """
+        numpy = load_numpy()
+        if numpy is None:
+            print('NumPy is required for to_numpy().')
+            return None
+        return numpy.frombuffer(self.timestamps), numpy.frombuffer(self.values)
+
+
+class Metrics:
+
+    def __init__(self, unity):
+        """
+        Metrics of a Unity system.  Created by Unity.connect(), as unity.metrics.
+        :param unity: A connected Unity object
+        """
+        self.unity = unity
+
+    def create_query(self, paths: list, interval: int = 5):
+        """
+        Creates a metricRealTimeQuery on the array.
+        :return: ID of the query, or None if it was refused (the error is printed)
+        """
+        answer = self.unity.create('metricRealTimeQuery', list(paths), interval)
+        if answer is None or 'error' in answer:
+            print('Could not create the metric query: {}'.format(answer and answer['error']))
+            return None
+        return answer.get('content', answer).get('id')
+
+    def delete_query(self, query_id):
+        return self.unity.delete('metricRealTimeQuery', rid=query_id)
+
+    def results(self, query_id):
+        """
+        Reads the current results of a real-time query.
+        :return: Generator of Sample
+        """
+        entries = self.unity.iter('metricQueryResult', fields='queryId,path,timestamp,values',
+                                  filter='queryId EQ {}'.format(query_id), raise_errors=True)
+        for entry in entries:
+            content = entry['content']
+            when = timestamp(content['timestamp'])
+            path = content['path']
+            for name, value in flatten(content.get('values') or {}):
+                yield Sample(when, path, name, value)
+
+    def history(self, paths: list, start, end=None, workers: int = 4, step: float = None, how: str = 'mean',
+                page_size: int = 2000):
+        """
+        Reads the historical values of metric paths (metricValue) between
+        two times.
+
+        The paths are read concurrently, with at most 'workers' page requests
+        in flight in total: with fewer paths than workers, the pages of each
+        path are fetched in parallel too.  The values are
+        appended to packed float64 arrays as the pages arrive, without
+        keeping the entries.
+
+        :param paths: Metric paths with historical values (sp.*.cpu.summary.utilization...)
+        :param start: Start time (seconds since the epoch, datetime, or API timestamp)
+        :param end: End time (defaults to now)
+        :param workers: Maximum number of page requests in flight
+        :param step: Downsample to buckets of that many seconds (optional)
+        :param how: Aggregation of the downsampled buckets: 'mean', 'min', 'max' or 'last'
+        :param page_size: Number of entries per page
+        :return: Dictionary of path -> {object -> Series}
+        """
+        condition = 'path EQ "{}" AND timestamp GE "{}" AND timestamp LT "{}"'
+        begin, finish = isoformat(start), isoformat(time.time() if end is None else end)
+
+        def read(path):
+            series = {}
+            entries = self.unity.iter('metricValue', fields='path,timestamp,values', page_size=page_size,
+                                      filter=condition.format(path, begin, finish), workers=per_path,
+                                      raise_errors=True)
+            for entry in entries:
+                content = entry['content']
+                when = timestamp(content['timestamp'])
+                for name, value in flatten(content.get('values') or {}):
+                    target = series.get(name)
+                    if target is None:
+                        target = series[name] = Series()
+                    target.append(when, value)
+            for name in series:
+                series[name] = series[name].sort()
+                if step:
+                    series[name] = series[name].downsample(step, how)
+            return series
+
+        paths = list(paths)
+        workers = max(1, workers)
+        per_path = max(1, workers // max(1, len(paths)))
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(paths)))) as pool:
+            return dict(zip(paths, pool.map(read, paths)))
+
+    def stream(self, paths: list, interval: int = 5, duration: float = None, stop=None):
+        """
+        Generator of the samples of a set of metric paths, as they are
+        collected by the array.
+
+        The results of the query are read once per interval.  Only the
+        timestamp of the last result of each path is remembered, to skip
+        results that were already yielded, so memory does not grow with the
+        length of the stream.
+
+        :param paths: Metric paths (sp.*.storage.lun.*.readsRate...)
+        :param interval: Sampling interval of the query, in seconds (5 or more)
+        :param duration: Stop after that many seconds (optional)
+        :param stop: threading.Event stopping the stream when set (optional)
+        :return: Generator of Sample(timestamp, path, object, value)
+        """
+        query_id = self.create_query(paths, interval)
+        if query_id is None:
+            return
+        last = {}
+        start = time.monotonic()
+        polls = 0
+        try:
+            while True:
+                polls += 1
+                newest = {}
+                for sample in self.results(query_id):
+                    if sample.timestamp <= last.get(sample.path, 0):
+                        continue
+                    if sample.timestamp > newest.get(sample.path, 0):
+                        newest[sample.path] = sample.timestamp
+                    yield sample
+                last.update(newest)
+                wake = start + polls * interval
+                if duration is not None and wake - start > duration:
+                    return
+                delay = wake - time.monotonic()
+                if stop is not None:
+                    if stop.wait(max(0, delay)):
+                        return
+                elif delay > 0:
+                    time.sleep(delay)
+        finally:
+            self.delete_query(query_id)
+
+
+def stream_fleet(fleet, paths: list, interval: int = 5, duration: float = None, maxsize: int = 10000):
+    """
+    Streams the same metrics from every array of a UnityFleet.  One thread
+    per array feeds a bounded queue: when the consumer falls behind, the
+    threads wait instead of buffering without limit.
+
+    Example:
+
+        > for name, sample in stream_fleet(fleet, ['sp.*.cpu.summary.utilization'], interval=10):
+        >     print(name, sample)
+
+    :param fleet: A connected UnityFleet
+    :param maxsize: Maximum number of samples waiting to be consumed
+    :return: Generator of (array name, Sample)
+    """
+    samples = queue.Queue(maxsize)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                samples.put(item, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def collect(array):
+        try:
+            for sample in array.metrics.stream(paths, interval, duration, stop):
+                if not put((array.name, sample)):
+                    break
+        except Exception as e:
+            print('Metrics of {} stopped: {}'.format(array.name, e))
+        finally:
+            put(done)
+
+    threads = [threading.Thread(target=collect, args=(array,), daemon=True) for array in fleet]
+    for thread in threads:
+        thread.start()
+    running = len(threads)
+    try:
+        while running:
+            item = samples.get()
+            if item is done:
+                running -= 1
+            else:
+                yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,424 @@
+"""
+Provisioning engine: a plan of creates with their dependencies, executed
+concurrently across the arrays.
+
+A Plan is a graph of steps.  Each step creates one instance on one array,
+and can take the ID created by another step through an Id placeholder:
+
+    > plan = Plan()
+    > ns = plan.add('unity01', 'nasServer', 'nas01', 'nas01', 'spa', 'Pool_1')
+    > plan.add('unity01', 'nfsServer', 'nas01', Id(ns), nfsv3Enabled=True)
+    > plan.add('unity01', 'Filesystem', 'fs01', 'fs01', 'Pool_1', Id(ns), '100G', storage=True)
+    > print(plan.describe())
+    > results = Executor(plan, fleet, state='rollout.json').run()
+
+Steps whose dependencies are met run concurrently, with a cap on the
+creates in flight per array.  When a step fails, the steps depending on it
+are skipped.  Names given for ID parameters (pools, NAS servers...) are
+resolved with the resolver of the array (see resolver.py).
+
+With a state file, the IDs created are saved as the steps finish, and a
+later run of the same plan skips the steps that are already done.
+
+Before anything is created, preflight() checks the pools the plan takes
+space from: one pool query per array, all arrays at once, and the
+projected subscription of each pool against a threshold.
+"""
+from collections import namedtuple, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import json
+import os
+import threading
+import time
+from unity.table import load_numpy
+
+# Outcome of a step.  'status' is one of 'done', 'resumed' (done by an
+# earlier run), 'failed' or 'skipped' (a dependency failed).
+StepResult = namedtuple('StepResult', ('key', 'status', 'id', 'error', 'elapsed'))
+
+# Capacity of a pool before and after the plan, in bytes.  'subscription'
+# is the projected subscribed size in percent of the total size, 'error'
+# is set when the pool could not be read.
+PoolCheck = namedtuple('PoolCheck', ('frame', 'pool', 'sizeTotal', 'sizeUsed', 'sizeSubscribed', 'requested',
+                                     'subscription', 'over', 'error'))
+
+UNITS = {'G': 1 << 30, 'T': 1 << 40}
+
+
+class Id:
+    """
+    Placeholder for the ID created by another step of the plan.
+    """
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __repr__(self):
+        return '<id of {}>'.format(self.key)
+
+
+class Step:
+    __slots__ = ('key', 'frame', 'resource', 'name', 'args', 'kwargs', 'depends', 'storage')
+
+    def __init__(self, key, frame, resource, name, args, kwargs, depends, storage):
+        self.key = key
+        self.frame = frame
+        self.resource = resource
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self.depends = depends
+        self.storage = storage
+
+    def __repr__(self):
+        arguments = [repr(a) for a in self.args] + ['{}={!r}'.format(k, v) for k, v in self.kwargs.items()]
+        return "{}{}.create('{}', {})".format(self.frame, '.storageResource' if self.storage else '',
+                                              self.resource, ', '.join(arguments))
+
+
+class Plan:
+
+    def __init__(self):
+        self.steps = OrderedDict()
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __iter__(self):
+        return iter(self.steps.values())
+
+    def add(self, frame, resource, name, *args, depends=(), storage: bool = False, **kwargs):
+        """
+        Adds the creation of an instance to the plan.  Adding the same
+        instance (frame, resource and name) again returns the existing step.
+
+        :param frame: Name of the array
+        :param resource: Name of the class in classes.py
+        :param name: Name of the instance (identifies the step on the frame)
+        :param args: Arguments of the class.  Id(key) is replaced by the ID
+                     created by that step.
+        :param depends: Keys of other steps that must be done first (the
+                        steps of the Id arguments are added automatically)
+        :param storage: Create through storageResource (Filesystem, Lun...)
+        :param kwargs: Named arguments of the class
+        :return: Key of the step
+        """
+        key = '{}/{}/{}'.format(frame, resource, name)
+        if key in self.steps:
+            return key
+        needs = list(depends) + [a.key for a in list(args) + list(kwargs.values()) if isinstance(a, Id)]
+        self.steps[key] = Step(key, frame, resource, name, args, kwargs, tuple(OrderedDict.fromkeys(needs)),
+                               storage)
+        return key
+
+    def frames(self):
+        return list(OrderedDict.fromkeys(step.frame for step in self))
+
+    def order(self):
+        """
+        :return: The steps in an order where every step comes after its
+                 dependencies
+        :raises ValueError: If a dependency is missing or the graph has a cycle
+        """
+        missing = ['{} (needed by {})'.format(d, s.key) for s in self for d in s.depends if d not in self.steps]
+        if missing:
+            raise ValueError('Unknown steps: {}'.format(', '.join(missing)))
+        waiting = {s.key: len(s.depends) for s in self}
+        dependents = {}
+        for step in self:
+            for d in step.depends:
+                dependents.setdefault(d, []).append(step.key)
+        ready = deque(k for k, n in waiting.items() if n == 0)
+        ordered = []
+        while ready:
+            key = ready.popleft()
+            ordered.append(self.steps[key])
+            for d in dependents.get(key, ()):
+                waiting[d] -= 1
+                if waiting[d] == 0:
+                    ready.append(d)
+        if len(ordered) != len(self.steps):
+            raise ValueError('Circular dependencies between: {}'.format(
+                ', '.join(k for k, n in waiting.items() if n)))
+        return ordered
+
+    def capacity(self, exclude=()):
+        """
+        Sums the sizes of the filesystems (and LUNs) of the plan per pool.
+        Pools and sizes are the arguments given to the classes: the pool
+        name/ID second, the size like '100G' or '2T' (fourth for a
+        Filesystem, third for a Lun).
+        :param exclude: Keys of the steps to leave out (already done)
+        :return: OrderedDict of (frame, pool) -> bytes
+        """
+        keys, sizes = [], []
+        for step in self:
+            position = {'Filesystem': 3, 'Lun': 2}.get(step.resource) if step.storage else None
+            if position is None or step.key in exclude:
+                continue
+            size = step.kwargs.get('size', step.args[position] if len(step.args) > position else None)
+            keys.append((step.frame, step.args[1]))
+            sizes.append(float(size[:-1]) * UNITS[size[-1]])
+        pools = list(OrderedDict.fromkeys(keys))
+        index = {key: i for i, key in enumerate(pools)}
+        numpy = load_numpy() if sizes else None
+        if numpy is not None:
+            totals = numpy.bincount([index[k] for k in keys], weights=sizes, minlength=len(pools)).tolist()
+        else:
+            totals = [0.0] * len(pools)
+            for key, size in zip(keys, sizes):
+                totals[index[key]] += size
+        return OrderedDict((key, int(total)) for key, total in zip(pools, totals))
+
+    def describe(self):
+        """
+        :return: The plan as text, one create per line, grouped by frame (dry run)
+        """
+        lines = []
+        ordered = self.order()
+        for frame in self.frames():
+            steps = [s for s in ordered if s.frame == frame]
+            lines.append('{} ({} creates)'.format(frame, len(steps)))
+            lines.extend('    {}'.format(s) for s in steps)
+        return '\n'.join(lines)
+
+
+def connect(fleet, frames):
+    """
+    Adds the frames missing from the fleet, and connects to the frames that
+    are not connected yet, concurrently.
+    :return: Dictionary of frame -> error, for the frames that could not be reached
+    """
+    for frame in frames:
+        if frame not in fleet.arrays:
+            fleet.add(frame)
+
+    def login(array):
+        if array.name in frames and array.session is None:
+            array.connect(quiet=True)
+
+    errors = {}
+    for name, res in fleet.map(login).items():
+        if res.error:
+            errors[name] = res.error
+        elif name in frames and fleet[name].session is None:
+            errors[name] = 'Could not log in'
+    return errors
+
+
+def preflight(fleet, plan, threshold: float = 90.0, timeout: float = None):
+    """
+    Checks that the pools can take the filesystems of the plan.  All the
+    pools of an array are read with one query, on all the arrays at once.
+
+    :param fleet: UnityFleet (frames missing from it are added and connected)
+    :param plan: Plan, or dictionary of (frame, pool name/ID) -> bytes requested
+    :param threshold: Highest projected subscription allowed, in percent of the pool size
+    :param timeout: Seconds to wait for each array (optional)
+    :return: List of PoolCheck, in the order of the plan
+    """
+    requested = plan.capacity() if isinstance(plan, Plan) else OrderedDict(plan)
+    frames = list(OrderedDict.fromkeys(frame for frame, pool in requested))
+    offline = connect(fleet, frames)
+
+    def pools(array):
+        if array.name not in frames or array.name in offline:
+            return None
+        answer = array.get('pool', fields='name,sizeTotal,sizeUsed,sizeSubscribed', compact=True)
+        if answer is None or 'entries' not in answer:
+            raise ValueError((answer or {}).get('error', 'The pool query failed'))
+        return answer['entries']
+
+    found = {}
+    for name, res in fleet.map(pools, timeout=timeout).items():
+        if res.error:
+            offline.setdefault(name, res.error)
+        for entry in res.result or ():
+            content = entry['content']
+            found[(name, content['name'])] = found[(name, content['id'])] = content
+
+    keys = list(requested)
+    rows = [found.get(key, {}) for key in keys]
+    columns = [[row.get(field, 0) for row in rows] for field in ('sizeTotal', 'sizeUsed', 'sizeSubscribed')]
+    wanted = [requested[key] for key in keys]
+    numpy = load_numpy() if keys else None
+    if numpy is not None:
+        total = numpy.array(columns[0], dtype=float)
+        projected = numpy.array(columns[2], dtype=float) + numpy.array(wanted, dtype=float)
+        ratio = numpy.divide(projected * 100, total, out=numpy.full(len(keys), numpy.inf), where=total > 0).tolist()
+    else:
+        ratio = [(s + w) * 100 / t if t else float('inf') for t, s, w in zip(columns[0], columns[2], wanted)]
+
+    checks = []
+    for i, (frame, pool) in enumerate(keys):
+        if frame in offline:
+            error = offline[frame]
+        elif not rows[i]:
+            error = 'No pool named {!r} on {}'.format(pool, frame)
+        else:
+            error = None
+        checks.append(PoolCheck(frame, pool, columns[0][i], columns[1][i], columns[2][i], wanted[i],
+                                None if error else ratio[i], error is None and ratio[i] > threshold, error))
+    return checks
+
+
+def capacity_report(checks, threshold: float = 90.0):
+    """
+    :return: The results of preflight() as a text table
+    """
+    lines = ['{:<20} {:<16} {:>10} {:>10} {:>10} {:>10} {:>9}  {}'.format(
+        'frame', 'pool', 'total GB', 'used GB', 'subscr GB', '+ new GB', 'projected', 'status')]
+    for c in checks:
+        status = c.error or ('OVER {:g}%'.format(threshold) if c.over else 'ok')
+        projected = '-' if c.subscription is None else '{:.1f}%'.format(c.subscription)
+        lines.append('{:<20} {:<16} {:>10.0f} {:>10.0f} {:>10.0f} {:>10.0f} {:>9}  {}'.format(
+            c.frame, c.pool, c.sizeTotal / UNITS['G'], c.sizeUsed / UNITS['G'], c.sizeSubscribed / UNITS['G'],
+            c.requested / UNITS['G'], projected, status))
+    return '\n'.join(lines)
+
+
+class Executor:
+
+    def __init__(self, plan, fleet, workers: int = 16, per_frame: int = 4, state: str = None):
+        """
+        :param plan: Plan to execute
+        :param fleet: UnityFleet holding the frames of the plan.  Frames
+                      missing from the fleet are added (and connected).
+        :param workers: Maximum number of creates in flight overall
+        :param per_frame: Maximum number of creates in flight per frame
+        :param state: Path of a JSON file recording the steps done, to
+                      resume an interrupted run (optional)
+        """
+        self.plan = plan
+        self.fleet = fleet
+        self.workers = workers
+        self.per_frame = per_frame
+        self.state = state
+        self.lock = threading.Lock()
+        self.done = {}
+        if state and os.path.exists(state):
+            with open(state) as f:
+                self.done = json.load(f).get('done', {})
+
+    def save(self):
+        if not self.state:
+            return
+        temp = '{}.{}'.format(self.state, os.getpid())
+        with open(temp, 'w') as f:
+            json.dump({'saved': time.time(), 'done': self.done}, f, indent=1)
+        os.replace(temp, self.state)
+
+    def connect(self):
+        """
+        Connects to all the frames of the plan concurrently.
+        :return: Dictionary of frame -> error, for the frames that could not be reached
+        """
+        return connect(self.fleet, self.plan.frames())
+
+    @staticmethod
+    def created_id(answer):
+        """
+        :return: ID in the answer of a create (or of a storageResource create)
+        """
+        content = answer.get('content', {})
+        return content.get('id') or content.get('storageResource', {}).get('id')
+
+    def execute(self, step, ids):
+        start = time.monotonic()
+        array = self.fleet[step.frame]
+        try:
+            args = [ids[a.key] if isinstance(a, Id) else a for a in step.args]
+            kwargs = {k: ids[v.key] if isinstance(v, Id) else v for k, v in step.kwargs.items()}
+            args, kwargs = array.resolver.arguments(step.resource, args, kwargs)
+            target = array.storageResource if step.storage else array
+            answer = target.create(step.resource, *args, **kwargs)
+            if answer is None:
+                raise ValueError('The request was not sent')
+            if 'error' in answer:
+                raise ValueError(answer['error'])
+            rid = self.created_id(answer)
+        except Exception as e:
+            return StepResult(step.key, 'failed', None, e, time.monotonic() - start)
+        with self.lock:
+            self.done[step.key] = rid
+            self.save()
+        return StepResult(step.key, 'done', rid, None, time.monotonic() - start)
+
+    def run(self):
+        """
+        Executes the plan.
+        :return: Dictionary of step key -> StepResult, in the order of the plan
+        """
+        ordered = self.plan.order()
+        results = {}
+        ids = {}
+        for step in ordered:
+            if step.key in self.done:
+                ids[step.key] = self.done[step.key]
+                results[step.key] = StepResult(step.key, 'resumed', ids[step.key], None, 0)
+        todo = [s for s in ordered if s.key not in results]
+
+        offline = self.connect() if todo else {}
+        waiting = {s.key: sum(1 for d in s.depends if d not in results) for s in todo}
+        dependents = {}
+        for step in todo:
+            for d in step.depends:
+                dependents.setdefault(d, []).append(step)
+
+        def skip(key, reason):
+            for step in dependents.get(key, ()):
+                if step.key not in results:
+                    results[step.key] = StepResult(step.key, 'skipped', None, reason, 0)
+                    skip(step.key, reason)
+
+        ready = deque()
+        for step in todo:
+            if step.key in results:
+                # Skipped: depends on a step of an offline frame
+                continue
+            if step.frame in offline:
+                results[step.key] = StepResult(step.key, 'failed', None, offline[step.frame], 0)
+                skip(step.key, 'Depends on {}'.format(step.key))
+            elif waiting[step.key] == 0:
+                ready.append(step)
+
+        inflight = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {}
+            while ready or futures:
+                for step in list(ready):
+                    if len(futures) >= self.workers:
+                        break
+                    if inflight.get(step.frame, 0) < self.per_frame and step.key not in results:
+                        ready.remove(step)
+                        inflight[step.frame] = inflight.get(step.frame, 0) + 1
+                        futures[pool.submit(self.execute, step, dict(ids))] = step
+                    elif step.key in results:
+                        ready.remove(step)
+                if not futures:
+                    continue
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = futures.pop(future)
+                    inflight[step.frame] -= 1
+                    result = results[step.key] = future.result()
+                    if result.status == 'failed':
+                        skip(step.key, 'Depends on {}'.format(step.key))
+                        continue
+                    ids[step.key] = result.id
+                    for following in dependents.get(step.key, ()):
+                        waiting[following.key] -= 1
+                        if waiting[following.key] == 0 and following.key not in results:
+                            ready.append(following)
+        return OrderedDict((s.key, results[s.key]) for s in ordered if s.key in results)
+
+
+def summary(results):
+    """
+    :return: Number of steps per status, like {'done': 40, 'failed': 1, 'skipped': 3}
+    """
+    counts = {}
+    for result in results.values():
+        counts[result.status] = counts.get(result.status, 0) + 1
+    return counts
@@ -0,0 +1,167 @@
+"""
+Compact, __slots__ based records for query results.
+
+Holding whole inventories (100k+ snaps or quotas) as the dictionaries
+returned by the API costs a lot of memory.  A record class is generated
+per resource and set of fields, with one slot per field and no __dict__:
+
+    > record = from_content('filesystem', 'name,sizeTotal,pool', entry['content'])
+    > record.name, record.sizeTotal, record.pool.id
+
+References to other instances ({'id': 'pool_1'}) are stored as shared
+Ref objects, so all the filesystems of a pool point to the same one.
+Other nested objects (health, tasks...) are only turned into records the
+first time they are read.
+"""
+import sys
+import threading
+import weakref
+
+classes_lock = threading.Lock()
+record_classes = {}
+# Refs in use, by ID.  A Ref is dropped with the last record pointing to it.
+refs = weakref.WeakValueDictionary()
+
+
+class Ref:
+    """
+    Reference to another instance, like the 'pool' of a filesystem.
+    Refs are shared: there is only one Ref object per ID.
+    """
+    __slots__ = ('id', '__weakref__')
+
+    def __init__(self, rid):
+        self.id = rid
+
+    def __repr__(self):
+        return 'Ref({!r})'.format(self.id)
+
+    def __eq__(self, other):
+        return isinstance(other, Ref) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    @staticmethod
+    def get(rid):
+        ref = refs.get(rid)
+        if ref is None:
+            ref = refs.setdefault(rid, Ref(sys.intern(rid) if isinstance(rid, str) else rid))
+        return ref
+
+
+class Record:
+    """
+    Base class of the generated record classes.
+    """
+    __slots__ = ()
+    record_resource = None
+    record_fields = ()
+
+    def __init__(self, content):
+        for field in self.record_fields:
+            setattr(self, '_' + field, compact(content.get(field)))
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__,
+                               ', '.join('{}={!r}'.format(f, getattr(self, '_' + f)) for f in self.record_fields))
+
+    def __eq__(self, other):
+        return type(other) is type(self) and all(getattr(self, '_' + f) == getattr(other, '_' + f)
+                                                  for f in self.record_fields)
+
+    def get(self, field, default=None):
+        if field not in self.record_fields:
+            return default
+        return getattr(self, field)
+
+    def as_dict(self):
+        """
+        :return: The record as a plain dictionary (like the 'content' of an entry)
+        """
+        return {f: expand(getattr(self, '_' + f)) for f in self.record_fields}
+
+
+def compact(value):
+    """
+    Stores references as shared Ref objects.  Everything else is kept as
+    is until it is read.
+    """
+    if type(value) is dict and len(value) == 1 and 'id' in value:
+        return Ref.get(value['id'])
+    return value
+
+
+def decode(value):
+    """
+    Turns nested dictionaries (and lists of them) into records.
+    """
+    if type(value) is dict and all(k.isidentifier() for k in value):
+        return record_class(None, tuple(value))(value)
+    if type(value) is list and value and type(value[0]) is dict:
+        return [decode(v) for v in value]
+    return value
+
+
+def expand(value):
+    if isinstance(value, Record):
+        return value.as_dict()
+    if isinstance(value, Ref):
+        return {'id': value.id}
+    if type(value) is list:
+        return [expand(v) for v in value]
+    return value
+
+
+def lazy(slot):
+    def getter(self):
+        value = getattr(self, slot)
+        decoded = decode(value)
+        if decoded is not value:
+            setattr(self, slot, decoded)
+        return decoded
+    return property(getter)
+
+
+def field_names(fields):
+    """
+    Top level field names of a 'fields' query parameter ('pool.name' -> 'pool').
+    The ID is always part of a record.
+    """
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    names = ['id']
+    for field in fields or ():
+        name = field.strip().split('.')[0]
+        if name and name not in names:
+            names.append(name)
+    return tuple(names)
+
+
+def record_class(resource, fields):
+    """
+    Returns the record class of a resource for a tuple of top level field
+    names.  Classes are generated once and reused.
+    """
+    key = (resource, fields)
+    cls = record_classes.get(key)
+    if cls is None:
+        with classes_lock:
+            cls = record_classes.get(key)
+            if cls is None:
+                name = resource[:1].upper() + resource[1:] if resource else 'Nested'
+                attrs = {'__slots__': tuple('_' + f for f in fields), 'record_resource': resource,
+                         'record_fields': fields}
+                attrs.update((f, lazy('_' + f)) for f in fields)
+                cls = record_classes[key] = type(name, (Record,), attrs)
+    return cls
+
+
+def from_content(resource, fields, content):
+    """
+    Builds the record of the 'content' of an entry.
+    :param resource: Type of the resource
+    :param fields: Fields of the query (comma separated string or list)
+    :param content: 'content' dictionary of the entry
+    """
+    return record_class(resource, field_names(fields))(content)
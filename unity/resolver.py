@@ -0,0 +1,163 @@
+"""
+Resolution of instance names to IDs.
+
+The create classes of classes.py take IDs (poolId, nasServerId...), while
+input sheets usually carry names.  Instead of one get(resource, rname=...)
+per reference, the Resolver loads the name -> ID map of a resource type with
+one collection query and answers every lookup of that type from it:
+
+    > nas.resolver.resolve('pool', 'Pool_Gold')
+    'pool_3'
+    > nas.storageResource.create('Filesystem', 'fs1', 'Pool_Gold', 'nas01', '5G', resolve=True)
+
+Values that already are IDs of the resource type are kept as they are.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import inspect
+import threading
+from unity import classes
+
+# Parameters of the classes of classes.py (and their keyword arguments)
+# that hold the ID of another instance -> type of that instance
+PARAMETERS = {
+    'poolId': 'pool',
+    'destinationPoolId': 'pool',
+    'nasServerId': 'nasServer',
+    'filesystemId': 'filesystem',
+    'snapId': 'snap',
+    'hostId': 'host',
+    'storageResource': 'storageResource',
+    'sourceStorageResourceId': 'storageResource',
+    'tenant': 'tenant',
+}
+
+
+class NameMap:
+    """
+    Names and IDs of all the instances of one resource type.
+    """
+    __slots__ = ('ids', 'names', 'duplicates')
+
+    def __init__(self, entries):
+        self.ids = set()
+        self.names = {}
+        self.duplicates = set()
+        for entry in entries:
+            content = entry['content']
+            self.ids.add(content['id'])
+            name = content.get('name')
+            if name in self.names:
+                self.duplicates.add(name)
+            self.names[name] = content['id']
+
+
+class Resolver:
+
+    def __init__(self, unity):
+        """
+        Name -> ID maps of a Unity system.  Created by Unity.connect(), as
+        unity.resolver.  Maps are loaded on first use and reloaded when a
+        name is not found after the resource type was changed through the
+        same Unity object (create, modify, delete...).
+        :param unity: A connected Unity object
+        """
+        self.unity = unity
+        self.maps = {}
+        self.stale = set()
+        self.loads = 0
+        self.lock = threading.Lock()
+        self.signatures = {}
+        # Number of invalidations per resource type, so a load that started
+        # before a change does not clear the stale mark set by that change
+        self.generations = {}
+
+    def load(self, resource):
+        """
+        Reads the names and IDs of all the instances of a resource type.
+        """
+        generation = self.generations.get(resource, 0)
+        entries = self.unity.iter(resource, fields='name', raise_errors=True)
+        names = NameMap(entries)
+        with self.lock:
+            self.maps[resource] = names
+            if self.generations.get(resource, 0) == generation:
+                self.stale.discard(resource)
+            self.loads += 1
+        return names
+
+    def prefetch(self, *resources):
+        """
+        Loads the maps of several resource types in parallel.
+        """
+        missing = [r for r in resources if r not in self.maps or r in self.stale]
+        if len(missing) > 1:
+            with ThreadPoolExecutor(max_workers=len(missing)) as pool:
+                list(pool.map(self.load, missing))
+        elif missing:
+            self.load(missing[0])
+
+    def invalidate(self, resource=None):
+        """
+        Marks the map of a resource type (or all of them) as possibly out of date.
+        """
+        with self.lock:
+            for name in [resource] if resource else list(self.maps):
+                self.stale.add(name)
+                self.generations[name] = self.generations.get(name, 0) + 1
+
+    def resolve(self, resource, value):
+        """
+        Returns the ID of an instance given its name or its ID.  Batch task
+        references ('@task1.id') are returned as they are.
+        :param resource: Type of the instance
+        :param value: Name or ID of the instance
+        :raises LookupError: If there is no instance (or more than one) with that name
+        """
+        if not isinstance(value, str) or value.startswith('@'):
+            return value
+        names = self.maps.get(resource)
+        if names is None:
+            names = self.load(resource)
+        for attempt in range(2):
+            if value in names.ids:
+                return value
+            if value in names.duplicates:
+                raise LookupError('More than one {} named {!r} on {}'.format(resource, value, self.unity.name))
+            if value in names.names:
+                return names.names[value]
+            if attempt == 0 and resource in self.stale:
+                names = self.load(resource)
+            else:
+                break
+        raise LookupError('No {} named {!r} on {}'.format(resource, value, self.unity.name))
+
+    def parameters(self, resource):
+        """
+        :return: Names of the positional parameters of the class of a resource
+        """
+        names = self.signatures.get(resource)
+        if names is None:
+            cls = getattr(classes, resource)
+            kinds = (inspect.Parameter.POSITIONAL_ONLY, inspect.Parameter.POSITIONAL_OR_KEYWORD)
+            names = [p.name for p in inspect.signature(cls.__init__).parameters.values() if p.kind in kinds][1:]
+            self.signatures[resource] = names
+        return names
+
+    def references(self, resource):
+        """
+        :return: Resource types the class of a resource takes IDs of
+        """
+        return {PARAMETERS[n] for n in self.parameters(resource) if n in PARAMETERS}
+
+    def arguments(self, resource, args, kwargs):
+        """
+        Replaces the names given for the ID parameters of a create class by
+        the IDs.
+        :param resource: Name of the class in classes.py
+        :return: (args, kwargs) with IDs
+        """
+        names = self.parameters(resource)
+        args = [self.resolve(PARAMETERS[n], a) if n in PARAMETERS else a for n, a in zip(names, args)] + \
+            list(args[len(names):])
+        kwargs = {k: self.resolve(PARAMETERS[k], v) if k in PARAMETERS else v for k, v in kwargs.items()}
+        return args, kwargs
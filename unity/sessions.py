@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+import time
+
+
+class SessionStore:
+
+    def __init__(self, path: str = '~/.emcpy/sessions', max_age: float = 3600):
+        """
+        On-disk store of Unity login sessions (cookies + CSRF token), so
+        short-lived scripts can reuse the session of the previous run instead
+        of logging in again and opening a new loginSession on the array.
+
+        There is one file per host/user, readable only by the owner.  A
+        session older than 'max_age' is ignored.  If the array refuses a
+        stored session anyway, the Unity object logs in again by itself.
+
+        Example:
+
+            > store = SessionStore()
+            > nas = Unity('hostname', user, password, session_store=store)
+            > nas.connect(quiet=True)
+
+        :param path: Directory of the session files
+        :param max_age: Maximum age of a stored session, in seconds
+        """
+        self.path = os.path.expanduser(path)
+        self.max_age = max_age
+
+    def file(self, host, user):
+        name = hashlib.sha256('{}\0{}'.format(host, user).encode()).hexdigest()
+        return os.path.join(self.path, '{}.json'.format(name))
+
+    def load(self, host, user):
+        """
+        :return: Dictionary with the 'cookies' and 'token' of the stored
+                 session, or None if there is no valid session
+        """
+        try:
+            with open(self.file(host, user)) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        now = time.time()
+        if saved.get('host') != host or saved.get('user') != user or now - saved.get('saved', 0) > self.max_age:
+            return None
+        if any(c.get('expires') and c['expires'] < now for c in saved.get('cookies', [])):
+            return None
+        return saved
+
+    def save(self, host, user, session):
+        """
+        Stores the cookies and CSRF token of a requests session.
+        """
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+        saved = {
+            'host': host,
+            'user': user,
+            'saved': time.time(),
+            'token': session.headers.get('EMC-CSRF-TOKEN'),
+            'cookies': [{'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path,
+                         'expires': c.expires, 'secure': c.secure} for c in session.cookies]
+        }
+        path = self.file(host, user)
+        temp = '{}.{}'.format(path, os.getpid())
+        fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(saved, f)
+        os.replace(temp, path)
+
+    def restore(self, host, user, session):
+        """
+        Loads a stored session into a requests session.
+        :return: True if a valid session was found
+        """
+        saved = self.load(host, user)
+        if saved is None:
+            return False
+        for c in saved['cookies']:
+            session.cookies.set(c['name'], c['value'], domain=c['domain'], path=c['path'],
+                                expires=c['expires'], secure=c['secure'])
+        if saved.get('token'):
+            session.headers.update({'EMC-CSRF-TOKEN': saved['token']})
+        return True
+
+    def remove(self, host, user):
+        try:
+            os.remove(self.file(host, user))
+        except OSError:
+            pass
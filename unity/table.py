@@ -0,0 +1,212 @@
+"""
+Columnar results of collection queries.
+
+Unity.get_table() streams the pages of a collection straight into one
+array per field, instead of keeping a dictionary per row.  Integer fields
+(sizes, counts...) are stored as int64 and floats as float64, so they can
+be handed to NumPy or Arrow without conversion:
+
+    > table = nas.get_table('filesystem', fields='name,pool,sizeTotal,sizeAllocated')
+    > table.sum_by('pool', 'sizeAllocated')
+    {'pool_1': 53687091200, 'pool_2': 1099511627776}
+    > table.write_parquet('filesystems.parquet')
+
+NumPy and pyarrow are optional.  Without NumPy, the aggregations fall back
+to plain Python; writing Parquet needs pyarrow.
+"""
+from array import array
+import csv
+import functools
+
+
+@functools.lru_cache(maxsize=None)
+def load_numpy():
+    """
+    Imports NumPy on first use (it is slow to import, and most scripts
+    never need it).
+    :return: The numpy module, or None if it is not installed
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def value_of(content, field):
+    """
+    Reads a field (possibly dotted, like 'pool.name') from the content of an
+    entry.  References ({'id': 'pool_1'}) are read as their ID.
+    """
+    value = content
+    for part in field.split('.'):
+        if type(value) is not dict:
+            return None
+        value = value.get(part)
+    if type(value) is dict and 'id' in value and len(value) == 1:
+        return value['id']
+    return value
+
+
+class Column:
+    """
+    One column of a Table.  It starts as an int64 or float64 array, based
+    on the first value, and falls back to a list when a value does not fit
+    (missing values, strings, nested objects...).
+    """
+    __slots__ = ('name', 'values', 'count')
+
+    def __init__(self, name):
+        self.name = name
+        self.values = None
+        self.count = 0
+
+    def append(self, value):
+        if self.values is None:
+            if value is None:
+                self.count += 1
+                return
+            if type(value) is int:
+                self.values = array('q')
+            elif type(value) is float:
+                self.values = array('d')
+            else:
+                self.values = []
+            # Values missing before the first one are None
+            if self.count:
+                self.values = [None] * self.count
+        if type(self.values) is array:
+            try:
+                self.values.append(value)
+            except (TypeError, OverflowError):
+                self.values = self.values.tolist()
+                self.values.append(value)
+        else:
+            self.values.append(value)
+        self.count += 1
+
+    @property
+    def dtype(self):
+        if type(self.values) is array:
+            return 'int64' if self.values.typecode == 'q' else 'float64'
+        return 'object'
+
+    def tolist(self):
+        if self.values is None:
+            return [None] * self.count
+        return list(self.values)
+
+
+class Table:
+
+    def __init__(self, resource, fields):
+        """
+        :param resource: Type of the resource the rows come from
+        :param fields: Fields of the query (comma separated string or list).
+                       The ID is always the first column.
+        """
+        if isinstance(fields, str):
+            fields = fields.split(',')
+        names = ['id'] + [f.strip() for f in fields or () if f.strip() and f.strip() != 'id']
+        self.resource = resource
+        self.columns = {name: Column(name) for name in names}
+        self.rows = 0
+
+    def __len__(self):
+        return self.rows
+
+    def __repr__(self):
+        return '<Table {} rows={} columns={}>'.format(self.resource, self.rows, list(self.columns))
+
+    def append(self, content):
+        """
+        Adds the content of one entry.  Only the values are kept.
+        """
+        for name, column in self.columns.items():
+            column.append(value_of(content, name))
+        self.rows += 1
+
+    def extend(self, entries):
+        """
+        Adds entries ({'content': {...}}) from any iterable, like Unity.iter().
+        """
+        for entry in entries:
+            self.append(entry['content'])
+        return self
+
+    def column(self, name):
+        """
+        :return: The values of a column, as a NumPy array (a copy) if NumPy is installed
+        """
+        column = self.columns[name]
+        numpy = load_numpy()
+        if numpy is None:
+            return column.values if column.values is not None else column.tolist()
+        if column.dtype == 'object':
+            return numpy.array(column.tolist(), dtype=object)
+        # A copy: a view would pin the array, and appending to it would fail
+        return numpy.frombuffer(column.values, dtype=column.dtype).copy()
+
+    def to_numpy(self):
+        """
+        :return: Dictionary of column name -> NumPy array
+        """
+        if load_numpy() is None:
+            print('NumPy is required for to_numpy().')
+            return None
+        return {name: self.column(name) for name in self.columns}
+
+    def to_arrow(self):
+        """
+        :return: pyarrow.Table with the same columns
+        """
+        try:
+            import pyarrow
+        except ImportError:
+            print('pyarrow is required for to_arrow().')
+            return None
+        arrays = {}
+        for name, column in self.columns.items():
+            if column.dtype == 'object':
+                arrays[name] = pyarrow.array(column.tolist())
+            else:
+                arrays[name] = pyarrow.array(memoryview(column.values), type=getattr(pyarrow, column.dtype)())
+        return pyarrow.table(arrays)
+
+    def sum_by(self, key, value):
+        """
+        Sums a numeric column per distinct value of another column, like the
+        allocated size of the filesystems per pool.
+        :return: Dictionary of key -> sum
+        """
+        keys = self.columns[key].tolist()
+        column = self.columns[value]
+        numpy = load_numpy()
+        if numpy is not None and column.dtype != 'object' and self.rows:
+            uniques, inverse = numpy.unique(numpy.array(keys, dtype=str), return_inverse=True)
+            totals = numpy.zeros(len(uniques), dtype=column.dtype)
+            numpy.add.at(totals, inverse, numpy.frombuffer(column.values, dtype=column.dtype))
+            return {k: v for k, v in zip(uniques.tolist(), totals.tolist())}
+        totals = {}
+        for k, v in zip(keys, column.tolist()):
+            if v is not None:
+                totals[str(k)] = totals.get(str(k), 0) + v
+        return totals
+
+    def write_csv(self, path):
+        """
+        Writes the table as CSV, with a header row.
+        """
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.columns)
+            writer.writerows(zip(*(column.tolist() for column in self.columns.values())))
+
+    def write_parquet(self, path):
+        """
+        Writes the table as Parquet (needs pyarrow).
+        """
+        table = self.to_arrow()
+        if table is not None:
+            import pyarrow.parquet
+            pyarrow.parquet.write_table(table, path)
@@ -0,0 +1,211 @@
+"""
+Timing of the requests and of the work done around them.
+
+A Tracer given to a Unity object records one span per HTTP request (method,
+resource, status, time to the response headers, time to read the body,
+bytes sent and received, retries), plus spans for the login, the payload
+builds of creates and the JSON decoding of the hot paths.  Spans go to a
+LatencyStats aggregator and to any callbacks (to export them elsewhere):
+
+    > tracer = Tracer()
+    > nas = Unity('hostname', user, password, tracer=tracer)
+    > ...
+    > print(tracer.stats.format())
+    resource           method                  count   p50 ms   p95 ms   p99 ms ...
+    filesystem         GET                       120     41.2     88.0    130.5 ...
+
+Without a tracer (the default), nothing is recorded and the only cost is a
+check for None.
+"""
+from array import array
+from collections import namedtuple
+import random
+import re
+import threading
+import time
+
+RESOURCE = re.compile(r'/api/(?:types|instances)/([^/?]+)')
+ACTION = re.compile(r'/action/([^/?]+)')
+
+# Percentiles computed by LatencyStats.report()
+Percentiles = namedtuple('Percentiles', ('resource', 'method', 'count', 'errors', 'p50', 'p95', 'p99', 'mean',
+                                         'bytes_in', 'bytes_out', 'retries'))
+
+
+class Span:
+    """
+    One timed operation.  Durations are in seconds.
+    """
+    __slots__ = ('tracer', 'name', 'resource', 'method', 'status', 'start', 'clock', 'duration', 'elapsed',
+                 'read', 'bytes_out', 'bytes_in', 'retries', 'error')
+
+    def __init__(self, tracer, name, resource=None, method=None):
+        self.tracer = tracer
+        self.name = name
+        self.resource = resource
+        self.method = method or name
+        self.status = None
+        self.start = time.time()
+        self.clock = None
+        self.duration = 0.0
+        self.elapsed = None
+        self.read = None
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.retries = 0
+        self.error = None
+
+    def __repr__(self):
+        return '<Span {} {} {} {:.1f} ms>'.format(self.name, self.resource, self.method, self.duration * 1000)
+
+    def __enter__(self):
+        self.clock = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.clock
+        if exc is not None:
+            self.error = repr(exc)
+        self.tracer.record(self)
+
+
+class LatencyStats:
+
+    def __init__(self, samples: int = 10000):
+        """
+        Aggregates spans per (resource, method).  Percentiles are computed
+        over at most 'samples' durations per key (a uniform sample of all
+        the spans), so the memory used does not grow with the run time.
+        """
+        self.samples = samples
+        self.lock = threading.Lock()
+        self.keys = {}
+
+    def add(self, span):
+        key = (span.resource or '-', span.method)
+        with self.lock:
+            entry = self.keys.get(key)
+            if entry is None:
+                # count, errors, bytes_in, bytes_out, retries, total, durations
+                entry = self.keys[key] = [0, 0, 0, 0, 0, 0.0, array('d')]
+            entry[0] += 1
+            entry[1] += 1 if span.error or (span.status or 0) >= 400 else 0
+            entry[2] += span.bytes_in
+            entry[3] += span.bytes_out
+            entry[4] += span.retries
+            entry[5] += span.duration
+            durations = entry[6]
+            if len(durations) < self.samples:
+                durations.append(span.duration)
+            else:
+                slot = random.randrange(entry[0])
+                if slot < self.samples:
+                    durations[slot] = span.duration
+
+    @staticmethod
+    def percentile(ordered, fraction):
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def report(self):
+        """
+        :return: List of Percentiles (durations in milliseconds), slowest p95 first
+        """
+        with self.lock:
+            entries = [(key, list(entry[:6]), sorted(entry[6])) for key, entry in self.keys.items()]
+        report = []
+        for (resource, method), (count, errors, bytes_in, bytes_out, retries, total), ordered in entries:
+            report.append(Percentiles(resource, method, count, errors,
+                                      self.percentile(ordered, 0.50) * 1000, self.percentile(ordered, 0.95) * 1000,
+                                      self.percentile(ordered, 0.99) * 1000, total / count * 1000,
+                                      bytes_in, bytes_out, retries))
+        return sorted(report, key=lambda p: p.p95, reverse=True)
+
+    def format(self):
+        """
+        :return: The report as a text table
+        """
+        lines = ['{:<28} {:<28} {:>7} {:>6} {:>9} {:>9} {:>9} {:>11} {:>11} {:>7}'.format(
+            'resource', 'method', 'count', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'bytes in', 'bytes out',
+            'retries')]
+        for p in self.report():
+            lines.append('{:<28} {:<28} {:>7} {:>6} {:>9.1f} {:>9.1f} {:>9.1f} {:>11} {:>11} {:>7}'.format(
+                p.resource, p.method, p.count, p.errors, p.p50, p.p95, p.p99, p.bytes_in, p.bytes_out, p.retries))
+        return '\n'.join(lines)
+
+    def reset(self):
+        with self.lock:
+            self.keys.clear()
+
+
+class Tracer:
+
+    def __init__(self, stats=None, callbacks=None):
+        """
+        :param stats: Aggregator of the spans.  Defaults to a new LatencyStats;
+                      set to False to only call the callbacks.
+        :param callbacks: Functions called with every finished Span (optional)
+        """
+        self.stats = LatencyStats() if stats is None else stats
+        self.callbacks = list(callbacks or ())
+
+    def span(self, name, resource=None, method=None):
+        """
+        Context manager timing a block of code:
+
+            > with tracer.span('report', 'filesystem'):
+            >     ...
+        """
+        return Span(self, name, resource, method)
+
+    def record(self, span):
+        if self.stats:
+            self.stats.add(span)
+        for callback in self.callbacks:
+            callback(span)
+
+    def install(self, session):
+        """
+        Adds the request hook to a requests session.  Done by Unity.connect().
+        """
+        session.hooks['response'].insert(0, self.response_hook)
+        return session
+
+    def response_hook(self, response, *args, **kwargs):
+        request = response.request
+        url = request.url
+        match = RESOURCE.search(url)
+        action = ACTION.search(url)
+        span = Span(self, 'request', match.group(1) if match else None,
+                    '{} {}'.format(request.method, action.group(1)) if action else request.method)
+        span.status = response.status_code
+        span.elapsed = response.elapsed.total_seconds()
+        body = request.body
+        if isinstance(body, (bytes, str)):
+            span.bytes_out = len(body)
+        elif hasattr(body, 'written'):
+            # Streamed uploads (MultipartStream): count what was actually sent
+            span.bytes_out = body.written
+        history = getattr(getattr(response.raw, 'retries', None), 'history', None)
+        span.retries = len(history) if history else 0
+        if kwargs.get('stream'):
+            # Streamed bodies are read by the caller: only count what is announced
+            span.bytes_in = int(response.headers.get('Content-Length') or 0)
+            span.duration = span.elapsed
+        else:
+            start = time.perf_counter()
+            span.bytes_in = len(response.content or b'')
+            span.read = time.perf_counter() - start
+            span.duration = span.elapsed + span.read
+        self.record(span)
+
+
+def call(tracer, name, resource, func, *args, **kwargs):
+    """
+    Calls func(*args, **kwargs), inside a span when there is a tracer.
+    """
+    if tracer is None:
+        return func(*args, **kwargs)
+    with Span(tracer, name, resource):
+        return func(*args, **kwargs)
@@ -0,0 +1,216 @@
+"""
+Streaming of the NAS server configuration files (download/upload).
+
+Unity.download_to() writes a download chunk by chunk to a path or a file
+object, and Unity.upload_from() sends a multipart body read chunk by chunk
+from a path, a file object, bytes or a generator, so files of any size are
+never held in memory.  Both can report their progress and compute a
+checksum of the content on the fly.
+"""
+from collections import namedtuple
+import hashlib
+import os
+import uuid
+
+# Outcome of a download or an upload: HTTP status, number of bytes of the
+# file transferred and hex digest of the file (if a checksum was asked for)
+Transfer = namedtuple('Transfer', ('status', 'bytes', 'checksum'))
+
+CHUNK_SIZE = 1 << 20
+
+
+def source_size(source):
+    """
+    :return: Size of a path, bytes or seekable file object, or None if it
+             cannot be known without reading it (generators, pipes...)
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return len(source)
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    if hasattr(source, 'seek') and hasattr(source, 'tell'):
+        try:
+            position = source.tell()
+            end = source.seek(0, os.SEEK_END)
+            source.seek(position)
+            return end - position
+        except OSError:
+            return None
+    return None
+
+
+def rewinder(source):
+    """
+    :return: Function putting a source back where it started, so it can be
+             read again for a new upload, or None if it can only be read
+             once (generators, pipes...)
+    """
+    if isinstance(source, (bytes, bytearray, memoryview, str, os.PathLike)):
+        return lambda: None
+    if hasattr(source, 'seek') and hasattr(source, 'tell'):
+        try:
+            if hasattr(source, 'seekable') and not source.seekable():
+                return None
+            position = source.tell()
+        except OSError:
+            return None
+        return lambda: source.seek(position)
+    return None
+
+
+def chunks(source, chunk_size: int = CHUNK_SIZE):
+    """
+    Yields the content of a source (path, bytes, file object or iterable of
+    bytes) as chunks.  Files opened here are closed at the end.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        for i in range(0, len(view), chunk_size):
+            yield view[i:i + chunk_size]
+    elif isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            yield from iter(lambda: f.read(chunk_size), b'')
+    elif hasattr(source, 'read'):
+        yield from iter(lambda: source.read(chunk_size), b'')
+    else:
+        yield from source
+
+
+class MultipartStream:
+    """
+    multipart/form-data body with one file field, produced while it is sent.
+
+    When the size of the file is known, the stream has a length and is sent
+    with a Content-Length header (requests reads it with read()).  Otherwise
+    it is sent with chunked transfer encoding (requests iterates over it).
+    """
+    def __init__(self, source, filename: str = None, field: str = 'file', chunk_size: int = CHUNK_SIZE,
+                 progress=None, checksum: str = None):
+        """
+        :param source: Path, bytes, file object or iterable of bytes
+        :param filename: Name of the file in the form (defaults to the name of the path)
+        :param field: Name of the form field
+        :param progress: Function called with (bytes sent, total bytes or None)
+        :param checksum: Name of a hashlib algorithm ('sha256'...) to hash the file with
+        """
+        if filename is None:
+            filename = os.path.basename(source) if isinstance(source, (str, os.PathLike)) else field
+        self.boundary = uuid.uuid4().hex
+        self.head = ('--{}\r\nContent-Disposition: form-data; name="{}"; filename="{}"\r\n'
+                     'Content-Type: application/octet-stream\r\n\r\n').format(self.boundary, field,
+                                                                            filename).encode()
+        self.tail = '\r\n--{}--\r\n'.format(self.boundary).encode()
+        self.size = source_size(source)
+        self.total = None if self.size is None else len(self.head) + self.size + len(self.tail)
+        self.progress = progress
+        self.hash = hashlib.new(checksum) if checksum else None
+        self.sent = 0
+        # Bytes of the whole body (form headers included) handed to requests
+        self.written = 0
+        self.parts = self.generate(source, chunk_size)
+        self.current = memoryview(b'')
+        self.offset = 0
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary={}'.format(self.boundary)
+
+    @property
+    def checksum(self):
+        return self.hash.hexdigest() if self.hash else None
+
+    def generate(self, source, chunk_size):
+        self.written += len(self.head)
+        yield self.head
+        for chunk in chunks(source, chunk_size):
+            if self.hash is not None:
+                self.hash.update(chunk)
+            self.sent += len(chunk)
+            self.written += len(chunk)
+            if self.progress is not None:
+                self.progress(self.sent, self.size)
+            yield bytes(chunk)
+        self.written += len(self.tail)
+        yield self.tail
+
+    def body(self):
+        """
+        :return: What to give to requests as 'data': the stream itself when
+                 its length is known, an iterable without length otherwise
+        """
+        return self if self.total is not None else ChunkedBody(self)
+
+    def __len__(self):
+        return self.total
+
+    def read(self, size: int = -1):
+        # Slices of the current chunk are returned without copying the rest of it
+        pieces = []
+        while size != 0:
+            if self.offset >= len(self.current):
+                part = next(self.parts, None)
+                if part is None:
+                    break
+                self.current, self.offset = memoryview(part), 0
+            end = len(self.current) if size < 0 else self.offset + size
+            piece = self.current[self.offset:end]
+            pieces.append(piece)
+            self.offset += len(piece)
+            if size > 0:
+                size -= len(piece)
+        return b''.join(pieces)
+
+
+class ChunkedBody:
+    """
+    Body of a MultipartStream of unknown size.  requests sends it with
+    chunked transfer encoding, and the tracer reads 'written' from it once
+    it is sent (a bare generator has no length to count).
+    """
+    __slots__ = ('stream',)
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def __iter__(self):
+        return self.stream.parts
+
+    @property
+    def written(self):
+        return self.stream.written
+
+
+def write_chunks(response, destination, chunk_size: int = CHUNK_SIZE, progress=None, checksum: str = None):
+    """
+    Writes the body of a streamed response to a path or file object.
+    Downloads to a path go to a temporary file first, so a failed download
+    does not leave a truncated file behind.
+    :return: Transfer
+    """
+    total = response.headers.get('Content-Length')
+    total = int(total) if total else None
+    digest = hashlib.new(checksum) if checksum else None
+    done = 0
+    path = None
+    if isinstance(destination, (str, os.PathLike)):
+        path = os.fspath(destination)
+        f = open(path + '.part', 'wb')
+    else:
+        f = destination
+    try:
+        for chunk in response.iter_content(chunk_size):
+            f.write(chunk)
+            if digest is not None:
+                digest.update(chunk)
+            done += len(chunk)
+            if progress is not None:
+                progress(done, total)
+    except BaseException:
+        if path is not None:
+            f.close()
+            os.remove(path + '.part')
+        raise
+    if path is not None:
+        f.close()
+        os.replace(path + '.part', path)
+    return Transfer(response.status_code, done, digest.hexdigest() if digest else None)
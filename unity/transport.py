@@ -0,0 +1,140 @@
+from collections import Counter
+import random
+import threading
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class TransportStats:
+    """
+    Counters of the retries done by a Transport, to see how often the
+    arrays push back.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.retries = 0
+        self.by_reason = Counter()
+        self.by_host = Counter()
+
+    def record(self, host, reason):
+        with self.lock:
+            self.retries += 1
+            self.by_reason[reason] += 1
+            self.by_host[host] += 1
+
+    def as_dict(self):
+        with self.lock:
+            return {'retries': self.retries, 'by_reason': dict(self.by_reason), 'by_host': dict(self.by_host)}
+
+
+class CountingRetry(Retry):
+    """
+    urllib3 Retry policy that records every retry in a TransportStats and
+    adds random jitter to the exponential backoff, so many clients pushed
+    back at the same time do not all come back at the same time.
+    """
+    def __init__(self, *args, stats=None, jitter: float = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = stats
+        self.jitter = jitter
+
+    def new(self, **kw):
+        retry = super().new(**kw)
+        retry.stats = self.stats
+        retry.jitter = self.jitter
+        return retry
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        return backoff + random.uniform(0, backoff * self.jitter)
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        # Raises MaxRetryError when the retries are exhausted: only the
+        # attempts that are actually retried are counted
+        retry = super().increment(method=method, url=url, response=response, error=error,
+                                  _pool=_pool, _stacktrace=_stacktrace)
+        if self.stats is not None:
+            reason = response.status if response is not None else type(error).__name__
+            self.stats.record(_pool.host if _pool is not None else None, reason)
+        return retry
+
+
+class TransportAdapter(HTTPAdapter):
+    """
+    HTTPAdapter applying a default timeout to every request.
+    """
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        return super().send(request, timeout=timeout if timeout is not None else self.timeout, **kwargs)
+
+
+class Transport:
+
+    def __init__(self, pool_size: int = 10, pool_block: bool = False, retries: int = 3, backoff: float = 0.5,
+                 jitter: float = 0.5, statuses=(429, 502, 503, 504), retry_posts: bool = False,
+                 timeout=None, keep_alive: bool = True):
+        """
+        Connection pool and retry settings of the requests session of a Unity
+        object.  Every request of Unity and storageResource goes through it.
+
+        Failed requests are retried with exponential backoff and jitter when
+        the array answers one of 'statuses' (the Retry-After header is
+        honored), or when the connection fails.  Only GET requests are
+        retried once they reached the array, since POST requests are not
+        idempotent: set 'retry_posts' to retry them too.
+
+        One Transport can be shared by many Unity objects.  Its 'stats'
+        count the retries per reason and per host.
+
+        Example:
+
+            > transport = Transport(pool_size=32, retries=5, timeout=(10, 300))
+            > nas = Unity('hostname', user, password, transport=transport)
+            > transport.stats.as_dict()
+            {'retries': 2, 'by_reason': {503: 2}, 'by_host': {'hostname': 2}}
+
+        :param pool_size: Maximum number of connections kept open per host
+        :param pool_block: Wait for a free connection instead of opening an
+                           extra one when the pool is exhausted
+        :param retries: Maximum number of retries of a request
+        :param backoff: Backoff factor, in seconds (backoff * 2 ** (retry - 1))
+        :param jitter: Random extra backoff, as a fraction of the backoff
+        :param statuses: HTTP statuses that are retried
+        :param retry_posts: Also retry POST requests
+        :param timeout: Default timeout of the requests, in seconds (or a
+                        (connect, read) tuple)
+        :param keep_alive: Keep the connections open between requests
+        """
+        self.pool_size = pool_size
+        self.pool_block = pool_block
+        self.retries = retries
+        self.backoff = backoff
+        self.jitter = jitter
+        self.statuses = statuses
+        self.retry_posts = retry_posts
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.stats = TransportStats()
+
+    def retry(self):
+        methods = {'GET', 'HEAD'}
+        if self.retry_posts:
+            methods.add('POST')
+        return CountingRetry(total=self.retries, backoff_factor=self.backoff, status_forcelist=self.statuses,
+                             allowed_methods=frozenset(methods), raise_on_status=False,
+                             respect_retry_after_header=True, stats=self.stats, jitter=self.jitter)
+
+    def mount(self, session):
+        """
+        Installs the connection pool and retry policy on a requests session.
+        """
+        adapter = TransportAdapter(timeout=self.timeout, pool_connections=self.pool_size,
+                                   pool_maxsize=self.pool_size, pool_block=self.pool_block,
+                                   max_retries=self.retry())
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({'Connection': 'keep-alive' if self.keep_alive else 'close'})
+        return session
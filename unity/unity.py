@@ -1,16 +1,90 @@
-import json
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import itertools
+import math
+import re
+import threading
 import requests
-from unity import classes
+from unity import classes, codec, records, trace
+from unity.jobs import Batch, Job
+from unity.metrics import Metrics
+from unity.resolver import Resolver
+from unity.table import Table
+from unity.transfer import CHUNK_SIZE, MultipartStream, Transfer, rewinder, write_chunks
+from unity.transport import Transport
+
+# Outcome of one item of a bulk operation.  'error' is the exception raised
+# while building or sending the item, or the error returned by the API.
+BulkResult = namedtuple('BulkResult', ('args', 'result', 'error'))
+
+
+def bulk(resource, items, post, concurrency, resolver=None):
+    """
+    Builds the payloads of all items up front, then posts them with at most
+    'concurrency' requests in flight.  Used by Unity.bulk_create() and
+    storageResource.bulk_create().
+
+    :param resource: Name of the class in classes.py
+    :param items: List of positional argument tuples.  If the last element of
+                  a tuple is a dictionary, it is used as the keyword arguments.
+    :param post: Function posting one JSON body and returning the response
+    :param concurrency: Maximum number of requests in flight
+    :param resolver: Resolver to turn the names given for ID parameters into IDs (optional)
+    :return: List of BulkResult, in the order of the items
+    """
+    if not isinstance(getattr(classes, resource, None), type):
+        print('Invalid resource name or class does not exist.')
+        return
+    if resolver is not None:
+        resolver.prefetch(*resolver.references(resource))
+    bodies = []
+    for item in items:
+        args = tuple(item)
+        kwargs = {}
+        if args and isinstance(args[-1], dict):
+            args, kwargs = args[:-1], args[-1]
+        try:
+            if resolver is not None:
+                args, kwargs = resolver.arguments(resource, args, kwargs)
+            bodies.append(classes.jsonify(classes.build(resource, *args, **kwargs)))
+        except Exception as e:
+            bodies.append(e)
+
+    def send(body):
+        if isinstance(body, Exception):
+            return None, body
+        try:
+            result = codec.decode(post(body))
+        except Exception as e:
+            return None, e
+        if 'error' in result:
+            return None, result['error']
+        return result, None
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = pool.map(send, bodies)
+        return [BulkResult(item, *outcome) for item, outcome in zip(items, outcomes)]
 
 
 class Unity:
 
-    def __init__(self, name, user, password):
+    def __init__(self, name, user, password, scheme: str = 'https', cache=None, session_store=None,
+                 transport=None, tracer=None):
         """
         Object instantiation.
         :param name: This is the name or IP of the Unity
         :param user: Username to log in with
         :param password: Password to log in with
+        :param scheme: URL scheme of the API.  Only useful to point the client
+                       at a local mock of the REST API ('http').
+        :param cache: A ResponseCache to cache the results of get() (optional)
+        :param session_store: A SessionStore to reuse the login session across
+                              runs (optional)
+        :param transport: A Transport with the connection pool and retry
+                          settings.  Defaults to Transport().
+        :param tracer: A Tracer recording the timings of the requests, logins,
+                       payload builds and decoding (optional, see trace.py)
 
         There are some other properties that I'm setting as empty for now.
         They will be used to for sub-classes (not inherited) after the
@@ -21,6 +95,18 @@ class Unity:
         self.name = name
         self.user = user
         self.password = password
+        self.url = '{}://{}'.format(scheme, name)
+        self.cache = cache
+        # refresh(): validators per (resource, ID, fields), and the key of the
+        # last result of each (these results are kept, so their id() is stable)
+        self.validators = {}
+        self.refreshed = {}
+        self.session_store = session_store
+        self.transport = transport or Transport()
+        self.tracer = tracer
+        self.login_lock = threading.Lock()
+        self.resolver = None
+        self.metrics = None
         self.session = None
         self.storageResource = None
 
@@ -75,6 +161,12 @@ class Unity:
 
         If the 'quiet' parameter is set to 'true', the connect method will
         not return anything (might be useful in a script).
+
+        If a SessionStore was given to this object and it holds a valid
+        session for this host/user, that session is reused instead of logging
+        in again (and with 'quiet', no request is sent at all).  Whenever the
+        array refuses the session (401/403), the object logs in again and
+        re-sends the request.
         """
         if self.session is not None:
             print('A session already exists for this object')
@@ -86,21 +178,96 @@ class Unity:
                     'X-EMC-REST-CLIENT': 'true'
             }
             requests.packages.urllib3.disable_warnings()
-            login_uri = 'https://{}/{}'.format(self.name, 'api/instances/system/0')
             session = requests.Session()
             session.headers.update(headers)
-            session.auth = (self.user, self.password)
-            parameters = {
-                'compact': 'true',
-                'fields': 'name,platform,model,serialNumber'
-            }
-            login = session.get(login_uri, verify=False, params=parameters)
-            token = login.headers.get('EMC-CSRF-TOKEN')
-            session.headers.update({'EMC-CSRF-TOKEN': token})
+            self.transport.mount(session)
+            if self.tracer is not None:
+                self.tracer.install(session)
+            session.hooks['response'].append(self._reauthenticate)
+            if self.session_store is not None and self.session_store.restore(self.name, self.user, session):
+                login = None
+            else:
+                login = trace.call(self.tracer, 'login', 'system', self._login, session)
             self.session = session
-            self.storageResource = storageResource(self.name, self.session)
+            self.resolver = Resolver(self)
+            self.metrics = Metrics(self)
+            self.storageResource = storageResource(self.name, self.session, self.url, self.cache, self.resolver,
+                                                   self.tracer)
             if quiet is False:
-                return login.json()
+                if login is None:
+                    login = session.get('{}/{}'.format(self.url, 'api/instances/system/0'), verify=False,
+                                        params={'compact': 'true', 'fields': 'name,platform,model,serialNumber'})
+                return codec.decode(login)
+
+    def _login(self, session):
+        """
+        Authenticates the session with the user/password, and stores the
+        CSRF token (and the session, if there is a session store).
+        :return: The response of the login query
+        """
+        login_uri = '{}/{}'.format(self.url, 'api/instances/system/0')
+        session.auth = (self.user, self.password)
+        parameters = {
+            'compact': 'true',
+            'fields': 'name,platform,model,serialNumber'
+        }
+        login = session.get(login_uri, verify=False, params=parameters)
+        token = login.headers.get('EMC-CSRF-TOKEN')
+        session.headers.update({'EMC-CSRF-TOKEN': token})
+        if self.session_store is not None and login.status_code == 200:
+            self.session_store.save(self.name, self.user, session)
+        return login
+
+    def _relogin(self, response):
+        """
+        Logs in again after the array refused a request because the session
+        expired (401) or the CSRF token is stale (403).
+        :return: True if the request can be sent again
+        """
+        request = response.request
+        if response.status_code not in (401, 403) or getattr(request, 'reauthenticated', False):
+            return False
+        if 'Authorization' in request.headers and (response.status_code == 401 or '/system/0' in request.url):
+            # The user/password themselves were refused, or the login itself failed
+            return False
+        session = self.session
+        if session is None:
+            return False
+        with self.login_lock:
+            # Another thread may have logged in again while this request was out
+            if request.headers.get('EMC-CSRF-TOKEN') == session.headers.get('EMC-CSRF-TOKEN'):
+                session.cookies.clear()
+                login = self._login(session)
+                if login.status_code != 200:
+                    return False
+        return True
+
+    def _reauthenticate(self, response, *args, **kwargs):
+        """
+        Response hook of the session.  When the array refuses a request
+        because the session expired (401) or the CSRF token is stale (403),
+        logs in again and re-sends the request once.  Streamed bodies (file
+        uploads) cannot be sent twice: upload_from() retries those itself.
+        """
+        request = response.request
+        if request.body is not None and not isinstance(request.body, (bytes, str)):
+            return response
+        if not self._relogin(response):
+            return response
+        session = self.session
+        retry = request.copy()
+        retry.reauthenticated = True
+        if session.headers.get('EMC-CSRF-TOKEN'):
+            retry.headers['EMC-CSRF-TOKEN'] = session.headers['EMC-CSRF-TOKEN']
+        retry.headers.pop('Cookie', None)
+        retry.prepare_cookies(session.cookies)
+        retry.prepare_auth(session.auth)
+        # Release the connection of the refused response
+        response.content
+        response.close()
+        new = session.send(retry, **kwargs)
+        new.history.insert(0, response)
+        return new
 
     def disconnect(self):
         """
@@ -116,8 +283,10 @@ class Unity:
 
         """
         if type(self.session) is requests.sessions.Session:
-            logout_uri = 'https://{}/api/types/loginSessionInfo/action/logout'.format(self.name)
+            logout_uri = '{}/api/types/loginSessionInfo/action/logout'.format(self.url)
             self.session.post(logout_uri, verify=False)
+            if self.session_store is not None:
+                self.session_store.remove(self.name, self.user)
             self.session = None
             self.storageResource = None
         else:
@@ -126,8 +295,20 @@ class Unity:
 
     @staticmethod
     def jsonify(data):
-        json_data = json.dumps(data.__dict__, default=lambda o: o.__dict__, indent=4)
-        return json_data
+        return classes.jsonify(data)
+
+    @staticmethod
+    def timeout_params(timeout):
+        """
+        Builds the query parameters for the 'timeout' argument of the
+        create/modify/delete functions.  A timeout of 0 makes the request
+        asynchronous: the API answers right away with the ID of a job.
+        """
+        if timeout is None:
+            return {}
+        elif isinstance(timeout, dict):
+            return timeout
+        return {'timeout': timeout}
 
     def delete(self, resource, rname=None, rid=None, timeout=None, **kwargs):
         """
@@ -141,42 +322,131 @@ class Unity:
                         like forcefully deleting snaps when deleting a storage resource.
         :return: Response code 204/202 (async)
         """
-        if rname and id:
+        if rname and rid:
             print('You cannot specify a name and an ID.')
             return
         elif rname:
-            endpoint = 'https://{}/{}/{}/{}'.format(self.name, 'api/instances', resource, 'name:{}'.format(rname))
+            endpoint = '{}/{}/{}/{}'.format(self.url, 'api/instances', resource, 'name:{}'.format(rname))
         elif rid:
-            endpoint = 'https://{}/{}/{}/{}'.format(self.name, 'api/instances', resource, rid)
+            endpoint = '{}/{}/{}/{}'.format(self.url, 'api/instances', resource, rid)
         else:
             print('No instance to given to delete.')
             return
-        timeout = timeout or {}
-        body = json.dumps(kwargs)
+        timeout = Unity.timeout_params(timeout)
+        body = codec.dumps(kwargs)
         response = self.session.delete(endpoint, params=timeout, data=body)
+        self.invalidate(resource)
         return response
 
-    def create(self, resource, *args, timeout=None, **kwargs):
+    def create(self, resource, *args, timeout=None, resolve: bool = False, **kwargs):
         """
         This function converts a python object to json and posts it to the
         right endpoint.  This function will work only if a class for the resource
         is defined in the classes.py file.  It will look up the required class
         and instantiate it with the arguments (from *args and **kwargs).
-        @todo need to support async requests
+        Use create_async() to run the create as a job and get a Job handle.
         :param resource: name of the resource to create
         :param timeout: timeout value.  Set to 0 for asynchronous requests
+        :param resolve: Accept names for the ID parameters (poolId, nasServerId...).
+                        They are looked up with the resolver (see resolver.py).
         :return: ID of the resource created, if successful
         """
-        class_name = getattr(classes, resource)
-        if not class_name:
-            print('Invalid resource name or class does not exist.')
-        obj = class_name(*args, **kwargs)
+        if resolve:
+            try:
+                args, kwargs = self.resolver.arguments(resource, args, kwargs)
+            except (AttributeError, LookupError) as e:
+                print(e)
+                return
+        obj = trace.call(self.tracer, 'build', resource, classes.build, resource, *args, **kwargs)
+        if obj is None:
+            return
         body = Unity.jsonify(obj)
         # print(body)
-        timeout = timeout or {}
-        endpoint = 'https://{}/{}/{}/{}'.format(self.name, 'api/types', resource, 'instances')
+        timeout = Unity.timeout_params(timeout)
+        endpoint = '{}/{}/{}/{}'.format(self.url, 'api/types', resource, 'instances')
         response = self.session.post(endpoint, data=body, params=timeout)
-        return response.json()
+        self.invalidate(resource)
+        return trace.call(self.tracer, 'decode', resource, codec.decode, response)
+
+    def create_async(self, resource, *args, **kwargs):
+        """
+        Starts a create as a job on the array (timeout=0) and returns right
+        away.  Wait for it with job.wait(), or for many jobs at once with a
+        JobWaiter.
+
+            > job = unity.create_async('nasServer', 'myNasServer', 'spa', 'pool_1')
+            > job.wait()
+            > job.result
+            {'id': 'nas_9'}
+
+        :return: Job
+        """
+        return Job.submitted(self, self.create(resource, *args, timeout=0, **kwargs))
+
+    def modify_async(self, resource, rname=None, rid=None, **kwargs):
+        """
+        Starts a modify as a job on the array.  See create_async()
+        :return: Job
+        """
+        return Job.submitted(self, self.modify(resource, rname=rname, rid=rid, timeout=0, **kwargs))
+
+    def delete_async(self, resource, rname=None, rid=None, **kwargs):
+        """
+        Starts a delete as a job on the array.  See create_async()
+        :return: Job
+        """
+        return Job.submitted(self, self.delete(resource, rname=rname, rid=rid, timeout=0, **kwargs))
+
+    def batch(self, description: str = '', wait: bool = True, interval: float = 5):
+        """
+        Context manager recording create/modify/delete/action calls as the
+        tasks of one job, submitted in a single request at the end of the
+        block.  Calls return references ('@task1.id') to the IDs created
+        earlier in the batch:
+
+            > with unity.batch('New NAS server') as b:
+            >     ns = b.create('nasServer', 'nas_t1', 'spa', 'pool_1')
+            >     b.create('nfsServer', ns)
+            >     b.storageResource.create('Filesystem', 'fs_t1', 'pool_1', ns, '100G')
+            > b.job.ok
+
+        :param description: Description of the job
+        :param wait: Wait for the job to finish at the end of the block
+        :param interval: Seconds between two polls of the job while waiting
+        :return: Batch
+        """
+        return Batch(self, description, wait=wait, interval=interval)
+
+    def bulk_create(self, resource, items: list, concurrency: int = 8, timeout=None, resolve: bool = False):
+        """
+        Creates many instances of a resource at once.  All the payloads are
+        built first (so a bad row fails before anything is sent), then they
+        are posted over the session with at most 'concurrency' requests in
+        flight.
+
+        Example:
+
+            > results = unity.bulk_create('nfsShare', [
+            >     ('snap_1', '/', 'share1'),
+            >     ('snap_2', '/', 'share2', {'description': 'Second share'}),
+            > ], concurrency=16)
+            > failed = [r for r in results if r.error]
+
+        :param resource: name of the resource to create
+        :param items: List of argument tuples, as they would be given to create().
+                      A dictionary at the end of a tuple holds the named arguments.
+        :param concurrency: Maximum number of requests in flight
+        :param timeout: timeout value.  Set to 0 for asynchronous requests
+        :param resolve: Accept names for the ID parameters (see create()).  The
+                        name maps needed are loaded once, before the first post.
+        :return: List of BulkResult(args, result, error), in the order of the items
+        """
+        timeout = Unity.timeout_params(timeout)
+        endpoint = '{}/{}/{}/{}'.format(self.url, 'api/types', resource, 'instances')
+        results = bulk(resource, items, lambda body: self.session.post(endpoint, data=body, params=timeout),
+                       concurrency, self.resolver if resolve else None)
+        self.invalidate(resource)
+        return results
 
     def modify(self, resource, rname=None, rid=None, timeout=None, **kwargs):
         """
@@ -187,16 +457,17 @@ class Unity:
         :return:
         """
         if rid:
-            endpoint = 'https://{}/{}/{}/{}/{}'.format(self.name, 'api/instances', resource, rid, 'action/modify')
+            endpoint = '{}/{}/{}/{}/{}'.format(self.url, 'api/instances', resource, rid, 'action/modify')
         elif rname:
-            endpoint = 'https://{}/{}/{}/{}/{}'.format(self.name, 'api/instances', resource, 'name:{}'.format(rname),
+            endpoint = '{}/{}/{}/{}/{}'.format(self.url, 'api/instances', resource, 'name:{}'.format(rname),
                                                        'action/modify')
         else:
             print('No resource name or ID specified.')
             return
-        timeout = timeout or {}
-        body = json.dumps(kwargs)
+        timeout = Unity.timeout_params(timeout)
+        body = codec.dumps(kwargs)
         response = self.session.post(endpoint, params=timeout, data=body)
+        self.invalidate(resource)
         return response
 
     def get(self, resource, rname=None, rid=None, **kwargs):
@@ -222,6 +493,8 @@ class Unity:
                         filter:  Filter for the query
                         groupby:  Group the results by a property
                         compact:  If true, metadata is ignored (instance queries only)
+                If a ResponseCache was given to this object, identical queries
+                are answered from the cache until the entry expires.
         :return: A query by name, id, or the entire collection will return
                     the object's ID, if no other fields are specified.  If
                     other fields are specified, and they are available via
@@ -231,13 +504,232 @@ class Unity:
             print('You cannot specify both a name and an ID.')
             return
         elif rname:
-            endpoint = 'https://{}/{}/{}/{}'.format(self.name, 'api/instances', resource, 'name:{}'.format(rname))
+            endpoint = '{}/{}/{}/{}'.format(self.url, 'api/instances', resource, 'name:{}'.format(rname))
         elif rid:
-            endpoint = 'https://{}/{}/{}/{}'.format(self.name, 'api/instances', resource, rid)
+            endpoint = '{}/{}/{}/{}'.format(self.url, 'api/instances', resource, rid)
         else:
-            endpoint = 'https://{}/{}/{}/{}'.format(self.name, 'api/types', resource, 'instances')
-        response = self.session.get(endpoint, params=kwargs)
-        return response.json()
+            endpoint = '{}/{}/{}/{}'.format(self.url, 'api/types', resource, 'instances')
+        if self.cache is None:
+            return trace.call(self.tracer, 'decode', resource, codec.decode, self.session.get(endpoint, params=kwargs))
+        key = self.cache.key(self.name, endpoint, kwargs)
+        result = self.cache.get(key)
+        if result is None:
+            result = trace.call(self.tracer, 'decode', resource, codec.decode,
+                                self.session.get(endpoint, params=kwargs))
+            if 'error' not in result:
+                self.cache.put(resource, key, result)
+        return result
+
+    def refresh(self, obj, resource: str = None, fields: str = None):
+        """
+        Re-reads an instance returned by get() (or by a previous refresh) and
+        returns quickly when it has not changed.
+
+        The client remembers the validators of the last answer for every
+        instance (and set of fields) it refreshed: the ETag/Last-Modified
+        headers when the API sends them, and a digest of the raw body
+        otherwise.  When the array says the
+        instance is unchanged (304) or the body is byte for byte the same,
+        the JSON is not parsed again and the object passed in is returned as
+        is.  So a poller can simply do:
+
+            > fs = unity.get('filesystem', rid='fs_1', fields='sizeUsed,health')
+            > new = unity.refresh(fs)
+            > if new is not fs:
+            >     # Something changed
+
+        Refreshed instances are queried with compact=true, so the result
+        only has the 'content' of the instance.
+
+        :param obj: Previous result of get() or refresh() for an instance
+        :param resource: Type of the resource.  Only needed for compact results
+                         of get(), since the type is otherwise read from '@base'.
+        :param fields: Fields to query.  Defaults to the fields present in obj.
+        :return: obj itself if the instance has not changed, the new result otherwise
+        """
+        # One record per instance and set of fields.  Its validators only
+        # apply if obj is the answer they were recorded for.
+        key = self.refreshed.get(id(obj))
+        if key is None or self.validators[key][-1] is not obj or resource or fields:
+            content = obj.get('content', {})
+            resource = resource or obj.get('@base', '').rstrip('/').rsplit('/', 1)[-1]
+            rid = content.get('id')
+            fields = fields or ','.join(content)
+            if not resource or not rid:
+                print('Cannot tell the resource type and ID of this object.')
+                return obj
+            key = (resource, rid, fields)
+        resource, rid, fields = key
+        record = self.validators.get(key)
+        if record is not None and record[-1] is obj:
+            etag, modified, digest = record[:-1]
+        else:
+            etag, modified, digest = None, None, None
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if modified:
+            headers['If-Modified-Since'] = modified
+        endpoint = '{}/{}/{}/{}'.format(self.url, 'api/instances', resource, rid)
+        response = self.session.get(endpoint, params={'fields': fields, 'compact': 'true'}, headers=headers)
+        new_digest = digest
+        if response.status_code == 304:
+            result = obj
+        else:
+            new_digest = hashlib.sha1(response.content).digest()
+            if new_digest == digest:
+                result = obj
+            else:
+                result = codec.decode(response)
+                if 'error' in result:
+                    return result
+                if result.get('content') == obj.get('content'):
+                    result = obj
+        if record is not None:
+            self.refreshed.pop(id(record[-1]), None)
+        self.validators[key] = (response.headers.get('ETag', etag), response.headers.get('Last-Modified', modified),
+                                new_digest, result)
+        self.refreshed[id(result)] = key
+        return result
+
+    def invalidate(self, resource=None):
+        """
+        Drops the cached get() results of a resource type for this system.
+        This is done automatically after every create, modify, delete and
+        action, so it is only needed when something else changed the system.
+        :param resource: Resource type to drop.  Everything is dropped if not given.
+        """
+        if self.cache is not None:
+            self.cache.invalidate(resource, host=self.name)
+        if self.resolver is not None:
+            self.resolver.invalidate(resource)
+
+    def iter(self, resource, fields=None, filter=None, page_size: int = 2000, workers: int = 1,
+             as_records: bool = False, raise_errors: bool = False, **kwargs):
+        """
+        Generator that walks an entire collection, one page at a time.
+
+        The get() function only returns the first page the API sends back,
+        which truncates large collections (snap, userQuota, treeQuota...).
+        This follows the 'next' links of each page and yields the entries
+        one at a time, so only a single page is held in memory.
+
+        For big collections the scan is dominated by round trips to the
+        array.  Setting 'workers' above 1 reads the entryCount from the
+        first page and fetches the remaining pages in parallel, with at most
+        'workers' requests in flight over the session.  Entries are still
+        yielded in order, and at most 'workers' pages are held in memory.
+
+        Example:
+
+            > for entry in unity.iter('snap', fields='name,creationTime'):
+            >     print(entry['content']['name'])
+
+            > events = unity.iter('event', fields='message', workers=4)
+
+        :param resource: Type of the resource to query
+        :param fields: Comma separated list of fields to return
+        :param filter: Filter for the query
+        :param page_size: Number of entries to request per page (per_page)
+        :param workers: Maximum number of page requests in flight at once
+        :param as_records: Yield compact records (see records.py) built from
+                        the content of the entries, instead of the entries
+        :param raise_errors: Raise a RuntimeError when a page fails, instead of
+                             printing the error and stopping, so callers can tell
+                             a partial collection from a complete one
+        :param kwargs: Any other query parameters (groupby, orderby...)
+        :return: Generator of entries ({'content': {...}}), or of records
+        """
+        endpoint = '{}/{}/{}/{}'.format(self.url, 'api/types', resource, 'instances')
+        params = dict(kwargs, per_page=page_size)
+        if fields:
+            params['fields'] = fields
+        if filter:
+            params['filter'] = filter
+        record = records.record_class(resource, records.field_names(fields)) if as_records else None
+        for page, response in self._pages(endpoint, params, workers):
+            if 'error' in response:
+                message = 'Query of {} failed on page {}: {}'.format(resource, page, response['error'])
+                if raise_errors:
+                    raise RuntimeError(message)
+                print(message)
+                return
+            for entry in response.get('entries', []):
+                yield record(entry['content']) if record else entry
+
+    def get_table(self, resource, fields, filter=None, page_size: int = 2000, workers: int = 1, **kwargs):
+        """
+        Reads a whole collection into a Table: one int64/float64/object
+        column per field, filled page by page without keeping a dictionary
+        per row.  Nested fields can be given dotted ('pool.name'), and
+        references ('pool') are read as their ID.
+
+        Example:
+
+            > table = unity.get_table('filesystem', fields='name,pool,sizeAllocated')
+            > table.sum_by('pool', 'sizeAllocated')
+            > table.write_csv('filesystems.csv')
+
+        :param resource: Type of the resource to query
+        :param fields: Comma separated list of fields (the columns)
+        :param filter: Filter for the query
+        :param page_size: Number of entries to request per page
+        :param workers: Maximum number of page requests in flight (see iter())
+        :return: Table
+        :raises RuntimeError: If a page cannot be read (rather than returning a partial table)
+        """
+        table = Table(resource, fields)
+        return table.extend(self.iter(resource, fields=fields, filter=filter, page_size=page_size,
+                                      workers=workers, raise_errors=True, **kwargs))
+
+    def _page(self, endpoint, params, page):
+        response = self.session.get(endpoint, params=dict(params, page=page))
+        if self.tracer is None:
+            return codec.decode(response)
+        # endpoint is .../api/types/<resource>/instances
+        return trace.call(self.tracer, 'decode', endpoint.split('/')[-2], codec.decode, response)
+
+    def _pages(self, endpoint, params, workers):
+        """
+        Yields (page number, response) for every page of a collection, in
+        order.  Pages after the first are prefetched on a bounded thread pool
+        when more than one worker is requested and the API told us how many
+        entries there are.
+        """
+        first = self._page(endpoint, params, 1)
+        count = first.get('entryCount')
+        if workers <= 1 or count is None or 'error' in first:
+            page, response = 1, first
+            while response is not None:
+                yield page, response
+                page = Unity.next_page(response) if response.get('entries') else None
+                response = self._page(endpoint, params, page) if page else None
+            return
+        last = max(1, math.ceil(count / params['per_page']))
+        remaining = iter(range(2, last + 1))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = deque((page, pool.submit(self._page, endpoint, params, page))
+                            for page in itertools.islice(remaining, workers))
+            yield 1, first
+            while pending:
+                page, future = pending.popleft()
+                for following in itertools.islice(remaining, 1):
+                    pending.append((following, pool.submit(self._page, endpoint, params, following)))
+                yield page, future.result()
+
+    @staticmethod
+    def next_page(response):
+        """
+        Returns the number of the next page of a collection response, or None
+        if this is the last page.  The API advertises the next page as a
+        link like {'rel': 'next', 'href': '&page=2'}.
+        """
+        for link in response.get('links', []):
+            if link.get('rel') == 'next':
+                match = re.search(r'[?&]page=(\d+)', link.get('href', ''))
+                if match:
+                    return int(match.group(1))
+        return None
 
     def download(self, nasServerId: str, fileType: int):
         """
@@ -254,9 +746,10 @@ class Unity:
                 9 - User_Mapping_Report
                 10 - Kerberos_Key_Table
                 11 - Homedir
-        :return: raw file in response body
+        :return: raw file in response body.  Use download_to() for big files,
+                 which writes them to disk as they arrive.
         """
-        endpoint = 'https://{}/{}/{}/{}/{}'.format(self.name, 'download', fileType, 'nasServer', nasServerId)
+        endpoint = '{}/{}/{}/{}/{}'.format(self.url, 'download', fileType, 'nasServer', nasServerId)
         print(endpoint)
         response = self.session.get(endpoint, stream=True)
         return response.content
@@ -280,13 +773,85 @@ class Unity:
                         and posted to the specified fileType location
         :return: Response 200/204 for success
         """
-        endpoint = 'https://{}/{}/{}/{}/{}'.format(self.name, 'upload', fileType, 'nasServer', nasServerId)
-        file = {'file': open(filePath, "rb")}
-        del self.session.headers['Content-Type']
-        response = self.session.post(endpoint, files=file)
-        self.session.headers.update({'Content-Type': 'application/json'})
+        endpoint = '{}/{}/{}/{}/{}'.format(self.url, 'upload', fileType, 'nasServer', nasServerId)
+        # The JSON Content-Type of the session is dropped for this request only,
+        # so requests sets the multipart one
+        with open(filePath, 'rb') as file:
+            response = self.session.post(endpoint, files={'file': file}, headers={'Content-Type': None})
         return response
 
+    def download_to(self, nasServerId: str, fileType: int, destination, chunk_size: int = CHUNK_SIZE,
+                    progress=None, checksum: str = None):
+        """
+        Downloads a configuration file of a NAS server to a path or a file
+        object, one chunk at a time, so the file is never held in memory.
+        A download to a path only replaces the file once it is complete.
+
+        Example:
+
+            > nas.download_to('nas_1', 9, 'mapping_report.txt', checksum='sha256',
+            >                 progress=lambda done, total: print(done, total))
+            Transfer(status=200, bytes=52428800, checksum='9f86d0...')
+
+        :param nasServerId: NAS Server to download the file from
+        :param fileType: Type of configuration file (see download())
+        :param destination: Path, or file object opened for binary writing
+        :param chunk_size: Size of the chunks read from the network
+        :param progress: Function called with (bytes received, total bytes or None)
+        :param checksum: Name of a hashlib algorithm ('sha256'...) to hash the file with
+        :return: Transfer(status, bytes, checksum).  Nothing is written if the
+                 array answers with an error (which is printed).
+        """
+        endpoint = '{}/{}/{}/{}/{}'.format(self.url, 'download', fileType, 'nasServer', nasServerId)
+        with self.session.get(endpoint, stream=True) as response:
+            if response.status_code != 200:
+                print('Download of file type {} from {} failed: {} {}'.format(fileType, nasServerId,
+                                                                            response.status_code, response.text))
+                return Transfer(response.status_code, 0, None)
+            return write_chunks(response, destination, chunk_size, progress, checksum)
+
+    def upload_from(self, nasServerId: str, fileType: int, source, filename: str = None,
+                    chunk_size: int = CHUNK_SIZE, progress=None, checksum: str = None):
+        """
+        Uploads a configuration file to a NAS server, reading it one chunk at
+        a time.  The headers are set for this request only, so concurrent
+        uploads through the same object are safe.
+
+        Example:
+
+            > nas.upload_from('nas_1', 7, '/etc/hosts', checksum='sha256')
+            Transfer(status=200, bytes=1024, checksum='4f3c1a...')
+
+        :param nasServerId: ID of the NAS Server to upload to
+        :param fileType: Type of configuration file (see upload())
+        :param source: Path, bytes, file object opened in binary mode, or
+                       generator of bytes.  A generator is sent with chunked
+                       transfer encoding, since its size is not known.  When
+                       the session has expired, the upload is sent again
+                       after a new login, unless the source is a generator
+                       or an unseekable file (it cannot be read twice).
+        :param filename: Name of the file in the form (defaults to the name of the path)
+        :param chunk_size: Size of the chunks read from the source
+        :param progress: Function called with (bytes sent, total bytes or None)
+        :param checksum: Name of a hashlib algorithm ('sha256'...) to hash the file with
+        :return: Transfer(status, bytes, checksum)
+        """
+        endpoint = '{}/{}/{}/{}/{}'.format(self.url, 'upload', fileType, 'nasServer', nasServerId)
+        rewind = rewinder(source)
+        for attempt in range(2):
+            stream = MultipartStream(source, filename, chunk_size=chunk_size, progress=progress, checksum=checksum)
+            response = self.session.post(endpoint, data=stream.body(), headers={'Content-Type': stream.content_type})
+            # The body is consumed: log in again and send a new stream if
+            # the session was refused and the source can be read again
+            if attempt or rewind is None or not self._relogin(response):
+                break
+            response.close()
+            rewind()
+        if response.status_code not in (200, 201, 204):
+            print('Upload of file type {} to {} failed: {} {}'.format(fileType, nasServerId,
+                                                                    response.status_code, response.text))
+        return Transfer(response.status_code, stream.sent, stream.checksum)
+
     def action(self, resource, action, rid: str = None, rname: str = None, **kwargs):
         """
 
@@ -301,74 +866,129 @@ class Unity:
             print('You cannot specify both a resource name and ID.')
             return
         elif rname:
-            endpoint = 'https://{}/{}/{}/{}/{}'.format(self.name, 'api/instances', resource, 'name:{}'.format(rname),
+            endpoint = '{}/{}/{}/{}/{}'.format(self.url, 'api/instances', resource, 'name:{}'.format(rname),
                                                        'action/{}'.format(action))
         elif rid:
-            endpoint = 'https://{}/{}/{}/{}/{}'.format(self.name, 'api/instances', resource, rid,
+            endpoint = '{}/{}/{}/{}/{}'.format(self.url, 'api/instances', resource, rid,
                                                        'action/{}'.format(action))
         else:
-            endpoint = 'https://{}/{}/{}/{}/{}'.format(self.name, 'api/types', resource, 'action', action)
-        body = json.dumps(kwargs)
+            endpoint = '{}/{}/{}/{}/{}'.format(self.url, 'api/types', resource, 'action', action)
+        body = codec.dumps(kwargs)
         response = self.session.post(endpoint, data=body)
+        self.invalidate(resource)
         return response
 
 
 class storageResource:
-    def __init__(self, name, session):
+    def __init__(self, name, session, url=None, cache=None, resolver=None, tracer=None):
         self.name = name
         self.session = session
+        self.url = url or 'https://{}'.format(name)
+        self.cache = cache
+        self.resolver = resolver
+        self.tracer = tracer
+
+    def invalidate(self, resource=None):
+        """
+        Drops the cached get() results of storage resources and of the
+        storage type (Filesystem -> filesystem, Lun -> lun...).  When the type
+        is not known, all the storage types are dropped.
+        """
+        types = [resource] if resource else ['Filesystem', 'Lun', 'VmwareLun']
+        for name in ['storageResource'] + [t[:1].lower() + t[1:] for t in types]:
+            if self.cache is not None:
+                self.cache.invalidate(name, host=self.name)
+            if self.resolver is not None:
+                self.resolver.invalidate(name)
 
     @staticmethod
     def jsonify(data):
-        json_data = json.dumps(data.__dict__, default=lambda o: o.__dict__, indent=4)
-        return json_data
+        return classes.jsonify(data)
 
     def get(self, rid=None, rname=None, **kwargs):
         if rname and rid:
             print('You cannot specify a name and an ID.')
             return
         elif rid:
-            endpoint = 'https://{}/{}/{}'.format(self.name, 'api/instances/storageResource', rid)
+            endpoint = '{}/{}/{}'.format(self.url, 'api/instances/storageResource', rid)
         elif rname:
-            endpoint = 'https://{}/{}/{}'.format(self.name, 'api/instances/storageResource', 'name:{}'.format(rname))
+            endpoint = '{}/{}/{}'.format(self.url, 'api/instances/storageResource', 'name:{}'.format(rname))
         else:
-            endpoint = 'https://{}/{}'.format(self.name, 'api/types/storageResource/instances')
+            endpoint = '{}/{}'.format(self.url, 'api/types/storageResource/instances')
         response = self.session.get(endpoint, params=kwargs)
-        return response.json()
+        return codec.decode(response)
 
-    def create(self, resource, *args, timeout=None, **kwargs):
+    def create(self, resource, *args, timeout=None, resolve: bool = False, **kwargs):
         """
 
         :param timeout:
         :param resource:
         :param payload:
+        :param resolve: Accept names for the ID parameters (see Unity.create())
         :return:
         """
         action = 'create{}'.format(resource)
-        class_name = getattr(classes, resource)
-        if not class_name:
-            print('Invalid resource name or class does not exist.')
+        if resolve:
+            try:
+                args, kwargs = self.resolver.arguments(resource, args, kwargs)
+            except (AttributeError, LookupError) as e:
+                print(e)
+                return
+        obj = trace.call(self.tracer, 'build', resource, classes.build, resource, *args, **kwargs)
+        if obj is None:
             return
-        obj = class_name(*args, **kwargs)
-        endpoint = 'https://{}/{}/{}'.format(self.name, 'api/types/storageResource/action', action)
+        endpoint = '{}/{}/{}'.format(self.url, 'api/types/storageResource/action', action)
         body = Unity.jsonify(obj)
-        timeout = timeout or {}
+        timeout = Unity.timeout_params(timeout)
         response = self.session.post(endpoint, params=timeout, data=body)
-        return response.json()
+        self.invalidate(resource)
+        return trace.call(self.tracer, 'decode', 'storageResource', codec.decode, response)
+
+    def create_async(self, resource, *args, **kwargs):
+        """
+        Starts the creation of a storage resource as a job.  See Unity.create_async()
+
+            > jobs = [nas.storageResource.create_async('Filesystem', name, 'pool_1', 'nas_1', '5G')
+            >         for name in names]
+            > JobWaiter(jobs).wait()
+
+        :return: Job
+        """
+        return Job.submitted(self, self.create(resource, *args, timeout=0, **kwargs))
+
+    def bulk_create(self, resource, items: list, concurrency: int = 8, timeout=None, resolve: bool = False):
+        """
+        Creates many storage resources at once.  See Unity.bulk_create()
+
+            > nas.storageResource.bulk_create('Filesystem', [
+            >     ('fs1', 'pool_1', 'nas_1', '5G'),
+            >     ('fs2', 'pool_1', 'nas_1', '1T', {'description': 'Big one'}),
+            > ])
+
+        :return: List of BulkResult(args, result, error), in the order of the items
+        """
+        action = 'create{}'.format(resource)
+        endpoint = '{}/{}/{}'.format(self.url, 'api/types/storageResource/action', action)
+        timeout = Unity.timeout_params(timeout)
+        results = bulk(resource, items, lambda body: self.session.post(endpoint, params=timeout, data=body),
+                       concurrency, self.resolver if resolve else None)
+        self.invalidate(resource)
+        return results
 
     def delete(self, rid=None, rname=None, timeout=None, **kwargs):
         if rname and rid:
             print('Cannot specify a name and an ID.')
             return
         elif rname:
-            endpoint = 'https://{}/{}/{}'.format(self.name, 'api/instances/storageResource', 'name:{}'.format(rname))
+            endpoint = '{}/{}/{}'.format(self.url, 'api/instances/storageResource', 'name:{}'.format(rname))
         elif rid:
-            endpoint = 'https://{}/{}/{}'.format(self.name, 'api/instances/storageResource', rid)
+            endpoint = '{}/{}/{}'.format(self.url, 'api/instances/storageResource', rid)
         else:
             print('No resource specified.')
             return
-        body = json.dumps(kwargs)
-        response = self.session.delete(endpoint, params=timeout, data=body)
+        body = codec.dumps(kwargs)
+        response = self.session.delete(endpoint, params=Unity.timeout_params(timeout), data=body)
+        self.invalidate()
         return response
 
     def modify(self, resource, rid=None, rname=None, timeout=None, **kwargs):
@@ -393,5 +1013,5 @@ class storageResource:
             print('Invalid resource or class does not exist.')
             return
         obj = class_name(*kwargs)
-        endpoint = 'https://{}/{}/{}/{}/{}'.format(self.name, 'api/instances/storageResource/', rid, 'action', action )
+        endpoint = '{}/{}/{}/{}/{}'.format(self.url, 'api/instances/storageResource/', rid, 'action', action )
 
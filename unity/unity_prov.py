@@ -1,5 +1,5 @@
 import csv
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 import datetime
 import getpass
 import logging
@@ -8,6 +8,7 @@ import os
 import sys
 import time
 import unity
+from unity.provision import Plan, Id, Executor, summary, preflight, capacity_report
 
 # Parse script arguments:
 parser = OptionParser()
@@ -23,19 +24,55 @@ parser.add_option("-s", "--sltn-number",
                   action="store",
                   dest="sltn_num",
                   default=None,
-                  help="SLTN Number to filter the input file on.")
+                  help="SLTN Number to filter the input file on (prov_tc column).")
 # username to connect to the Unity systems
 parser.add_option("-u", "--unity-user",
                   action="store",
                   dest="u",
                   default='admin',
                   help="Username to log into the Unity API.")
+# Without this switch, the script only prints what it would create (dry run)
+parser.add_option("-x", "--execute",
+                  action="store_true",
+                  dest="execute",
+                  default=False,
+                  help="Create the objects (default: print the plan only).")
+# Steps done are saved here, so an interrupted run can be resumed
+parser.add_option("--state",
+                  action="store",
+                  dest="state",
+                  default=None,
+                  help="JSON file recording the objects created, to resume a run.")
+parser.add_option("--workers",
+                  action="store",
+                  dest="workers",
+                  type="int",
+                  default=16,
+                  help="Maximum number of creates in flight.")
+parser.add_option("--per-frame",
+                  action="store",
+                  dest="per_frame",
+                  type="int",
+                  default=4,
+                  help="Maximum number of creates in flight per frame.")
+# Pools whose subscription would go over this percentage stop the run
+parser.add_option("-t", "--threshold",
+                  action="store",
+                  dest="threshold",
+                  type="float",
+                  default=90.0,
+                  help="Highest pool subscription allowed after provisioning, in percent (default 90).")
+parser.add_option("-c", "--check-capacity",
+                  action="store_true",
+                  dest="check",
+                  default=False,
+                  help="Only check the pool capacity on the frames (no creates).")
+parser.add_option("--force",
+                  action="store_true",
+                  dest="force",
+                  default=False,
+                  help="Create the objects even if a pool goes over the threshold.")
 
-# Prompt for password.
-p = getpass.getpass('Password (one password for all Unity systems): ')
-if not p:
-    print('You must specify a password.')
-    sys.exit()
 # Parse the arguments
 (opts, args) = parser.parse_args()
 # Get current user
@@ -49,79 +86,196 @@ row = namedtuple('row', ('status', 'prov_tc', 'prod_frame', 'prod_sp', 'prod_poo
                          'cob_mask', 'cob_broadcast', 'cob_qip', 'qtree', 'bkup_srvr', 'bkup_ip', 'bkup_mask',
                          'bkup_gw', 'sec_style', 'ad_group', 'netgroups'))
 
-# This reads the input file, skips the first row and
-# creates a tuple based on the 'template' above.  Then
-# we add that tuple to a list
-with open(opts.input_file, 'r') as f:
-    r = csv.reader(f, delimiter=',')
-    next(r)
-    rows = [row(*l) for l in r]
-
-# This is where we get a set of unique records based on the prod/cob frame
-unique_frame_pairs = set()
-unique_frame_list = []
+# Rows of the sheet grouped by frame pair -> NAS server -> filesystem.
+# The first row seen gives the settings of the NAS server/filesystem; the
+# other rows of a filesystem only add qtrees.
+NasGroup = namedtuple('NasGroup', ('line', 'row', 'filesystems'))
+FsGroup = namedtuple('FsGroup', ('line', 'row', 'qtrees'))
+
+# Columns that must hold the same value on all the rows of a NAS server/filesystem
+NAS_SERVER_FIELDS = ('prod_sp', 'prod_eth_dev', 'prod_ip', 'prod_mask', 'cob_nas_server', 'cob_sp', 'cob_eth_dev',
+                     'cob_ip', 'cob_mask', 'sec_style')
+FILESYSTEM_FIELDS = ('prod_pool', 'fs_capacity_gb', 'cob_pool', 'cob_fs')
+# Columns that cannot be empty
+REQUIRED_NAS_SERVER = ('prod_nas_server', 'prod_sp', 'prod_pool', 'prod_eth_dev', 'prod_ip', 'prod_mask',
+                       'cob_nas_server', 'cob_sp', 'cob_pool', 'cob_eth_dev', 'cob_ip', 'cob_mask')
+REQUIRED_FILESYSTEM = ('prod_fs', 'prod_pool', 'fs_capacity_gb', 'cob_fs', 'cob_pool')
+SECURITY_STYLES = ('CIFS', 'NFS', 'Mixed')
+
+
+def read_sheet(path):
+    """
+    Reads the sheet one row at a time (the header is skipped).
+    :return: Generator of (line number, list of values)
+    """
+    with open(path, 'r', newline='') as f:
+        reader = csv.reader(f, delimiter=',')
+        next(reader, None)
+        for values in reader:
+            if any(v.strip() for v in values):
+                yield reader.line_num, values
+
+
+def group_rows(lines, sltn_num, problems):
+    """
+    Groups the rows of the sheet in one pass.
+    :param lines: (line number, values) of the rows
+    :param sltn_num: Only keep the rows of this SLTN number (prov_tc column), or None for all
+    :param problems: List the errors found in the rows are appended to
+    :return: OrderedDict of (prod frame, cob frame) -> OrderedDict of NAS server -> NasGroup
+    """
+    pairs = OrderedDict()
+    for line, values in lines:
+        if len(values) != len(row._fields):
+            problems.append('Line {}: {} columns instead of {}'.format(line, len(values), len(row._fields)))
+            continue
+        r = row(*(v.strip() for v in values))
+        if sltn_num and r.prov_tc != sltn_num:
+            continue
+        servers = pairs.setdefault((r.prod_frame, r.cob_frame), OrderedDict())
+        ns = servers.get(r.prod_nas_server)
+        if ns is None:
+            ns = servers[r.prod_nas_server] = NasGroup(line, r, OrderedDict())
+        else:
+            problems.extend('Line {}: {} of NAS server {} is {!r}, but {!r} on line {}'.format(
+                line, field, r.prod_nas_server, getattr(r, field), getattr(ns.row, field), ns.line)
+                for field in NAS_SERVER_FIELDS if getattr(r, field) != getattr(ns.row, field))
+        fs = ns.filesystems.get(r.prod_fs)
+        if fs is None:
+            fs = ns.filesystems[r.prod_fs] = FsGroup(line, r, [])
+        else:
+            problems.extend('Line {}: {} of filesystem {} is {!r}, but {!r} on line {}'.format(
+                line, field, r.prod_fs, getattr(r, field), getattr(fs.row, field), fs.line)
+                for field in FILESYSTEM_FIELDS if getattr(r, field) != getattr(fs.row, field))
+        if r.qtree and r.qtree not in fs.qtrees:
+            fs.qtrees.append(r.qtree)
+    return pairs
+
+
+def validate(pairs, problems):
+    """
+    Checks the grouped rows before anything is sent to the arrays: empty
+    columns, sizes, security styles, and names or IPs used twice on a frame.
+    :param problems: List the errors found are appended to
+    """
+    owners = {}
+
+    def claim(kind, frame, name, owner, line):
+        if not name:
+            return
+        first = owners.setdefault((kind, frame, name), (owner, line))
+        if first[0] != owner:
+            problems.append('Line {}: {} {} on {} is also used by {} (line {})'.format(
+                line, kind, name, frame, first[0], first[1]))
+
+    for (prod_frame, cob_frame), servers in pairs.items():
+        if not prod_frame or not cob_frame:
+            problems.append('Line {}: prod_frame and cob_frame are required'.format(
+                next(iter(servers.values())).line))
+            continue
+        for name, ns in servers.items():
+            owner = '{} ({} -> {})'.format(name, prod_frame, cob_frame)
+            problems.extend('Line {}: {} is empty'.format(ns.line, field)
+                            for field in REQUIRED_NAS_SERVER if not getattr(ns.row, field))
+            if ns.row.sec_style not in SECURITY_STYLES:
+                problems.append('Line {}: sec_style of NAS server {} is {!r}, not one of {}'.format(
+                    ns.line, name, ns.row.sec_style, ', '.join(SECURITY_STYLES)))
+            claim('NAS server', prod_frame, name, owner, ns.line)
+            claim('NAS server', cob_frame, ns.row.cob_nas_server, owner, ns.line)
+            claim('IP', prod_frame, ns.row.prod_ip, owner, ns.line)
+            claim('IP', cob_frame, ns.row.cob_ip, owner, ns.line)
+            for fs_name, fs in ns.filesystems.items():
+                problems.extend('Line {}: {} is empty'.format(fs.line, field)
+                                for field in REQUIRED_FILESYSTEM if not getattr(fs.row, field))
+                try:
+                    if float(fs.row.fs_capacity_gb) <= 0:
+                        raise ValueError
+                except ValueError:
+                    problems.append('Line {}: fs_capacity_gb of {} is {!r}, not a size in GB'.format(
+                        fs.line, fs_name, fs.row.fs_capacity_gb))
+                claim('filesystem', prod_frame, fs_name, owner, fs.line)
+                claim('filesystem', cob_frame, fs.row.cob_fs, owner, fs.line)
+
+
+plan = Plan()
+problems = []
 print('Begin {}'.format(datetime.datetime.now()))
-for i in rows:
-    if (i.prod_frame, i.cob_frame) not in unique_frame_pairs:
-        unique_frame_list.append(i)
-    unique_frame_pairs.add((i.prod_frame, i.cob_frame))
+frame_pairs = group_rows(read_sheet(opts.input_file), opts.sltn_num, problems)
+validate(frame_pairs, problems)
+if problems:
+    print('The sheet has {} problems, nothing was done:'.format(len(problems)))
+    print('\n'.join(problems))
+    sys.exit(1)
 
 # fp = frame pair
-for fp in unique_frame_list:
-    # print('Prod: {} -> Cob: {}'.format(fp.prod_frame, fp.cob_frame))
+for fp, servers in frame_pairs.items():
     # This is where we do any frame level checks
     #
-    # Checks:
-    # 1. Test to be sure both prod/cob frame are reachable
-    # 2. Test to be sure the API is reachable (unauthenticated query)
-    # 3. Connect to the PROD/COB Frame
-    # 4. Figure out the current pool space/subscription ratio
-    # 5. Sum total all space to be provisioned, the recalculate the space/subscription
-    # 6. Warn if it will exceed a default threshold, add a configurable switch to modify threshold
+    # The frames are connected, and the pool space/subscription checked
+    # against --threshold, by preflight() before anything is created.
     #
-    prod_frame = unity.Unity(fp.prod_frame, opts.u, p)
-    prod_frame.connect(quiet=True)
-    cob_frame = unity.Unity(fp.cob_frame, opts.u, p)
-    cob_frame.connect(quiet=True)
-    # Evaluate pool space subscription ratio
-    prod_pool = prod_frame.get('pool', rid=0, fields='sizeSubscribed', compact=True)
-    cob_pool = cob_frame.get('pool', rid=0, fields='sizeSubscribed', compact=True)
-    # This is where we create a unique list of NAS servers for the
-    # current prod/cob frame pair
-    uniq_ns = set()
-    uniq_ns_list = []
-    for x in rows:
-        if fp.prod_frame == x.prod_frame and fp.cob_frame == x.cob_frame:
-            if x.prod_nas_server not in uniq_ns:
-                uniq_ns_list.append(x)
-            uniq_ns.add(x.prod_nas_server)
     # ns = nas server
-    for ns in uniq_ns_list:
+    for ns_group in servers.values():
         # This is where we do NAS Server level checks/operations
         #
         # 1. Test to be sure the NAS Server doesn't already exist
         # 2. Test to be sure the interface doesn't already exist (query and ping?)
         # 3. Check DNS setup
-        # 4. Check all types of filesystems that belong to this NAS Server
-        #   4a.  This seems like it might take a while
-        if ns.sec_style == 'CIFS':
-            print("prodUnity.create('nasServer', {}, {}, {})".format(ns.prod_nas_server, ns.prod_pool, ns.prod_sp))
-        elif ns.sec_style == 'NFS':
-            print('NFS')
-        elif ns.sec_style == 'Mixed':
-            print('Mixed')
-        else:
-            continue
-        # This is where we create a unique list of filesystems for the
-        # current NAS Server
-        uniq_fs = set()
-        uniq_fs_list = []
-        for y in rows:
-            if ns.prod_nas_server == y.prod_nas_server:
-                if y.prod_fs not in uniq_fs:
-                    uniq_fs_list.append(y)
-                uniq_fs.add(y.prod_fs)
+        ns = ns_group.row
+        # The cob NAS server is the replication destination of the prod one
+        ns_keys = {}
+        for site in ('prod', 'cob'):
+            frame, nas_server, sp = getattr(ns, site + '_frame'), getattr(ns, site + '_nas_server'), \
+                getattr(ns, site + '_sp').lower()
+            options = {'isReplicationDestination': True} if site == 'cob' else {}
+            ns_keys[site] = plan.add(frame, 'nasServer', nas_server, nas_server, sp, getattr(ns, site + '_pool'),
+                                     **options)
+            eth = getattr(ns, site + '_eth_dev')
+            port = eth if eth.startswith(sp + '_') else '{}_{}'.format(sp, eth)
+            plan.add(frame, 'fileInterface', getattr(ns, site + '_ip'), Id(ns_keys[site]), port,
+                     getattr(ns, site + '_ip'), netmask=getattr(ns, site + '_mask'))
+            if ns.sec_style in ('NFS', 'Mixed'):
+                plan.add(frame, 'nfsServer', nas_server, Id(ns_keys[site]), nfsv3Enabled=True)
         # fs = filesystem
-        for fs in uniq_fs_list:
+        for fs_group in ns_group.filesystems.values():
             # This is where we do Filesystem level checks/operations
-            print("prodUnity.storageResource.create('Filesystem', {}, {}, {}, {})".format(fs.prod_fs, fs.prod_nas_server, fs.prod_pool, fs.fs_capacity_gb))
+            fs = fs_group.row
+            for site in ('prod', 'cob'):
+                frame, name = getattr(fs, site + '_frame'), getattr(fs, site + '_fs')
+                options = {'isReplicationDestination': True} if site == 'cob' else {}
+                fs_key = plan.add(frame, 'Filesystem', name, name, getattr(fs, site + '_pool'), Id(ns_keys[site]),
+                                  '{}G'.format(fs.fs_capacity_gb), storage=True, **options)
+                # The quotas take the name of the filesystem, resolved once it exists
+                for qtree in fs_group.qtrees if site == 'prod' else ():
+                    plan.add(frame, 'treeQuota', '{}/{}'.format(name, qtree), name,
+                             '/' + qtree.lstrip('/'), depends=[fs_key])
+
+print('Plan: {} creates on {} frames'.format(len(plan), len(plan.frames())))
+if not opts.execute and not opts.check:
+    print(plan.describe())
+    sys.exit()
+
+# Prompt for password.
+p = getpass.getpass('Password (one password for all Unity systems): ')
+if not p:
+    print('You must specify a password.')
+    sys.exit()
+fleet = unity.UnityFleet([], opts.u, p)
+executor = Executor(plan, fleet, workers=opts.workers, per_frame=opts.per_frame, state=opts.state)
+# Pre-flight: capacity of all the pools of the plan, all frames at once
+# (filesystems already created by an earlier run are not counted again)
+checks = preflight(fleet, plan.capacity(exclude=executor.done), threshold=opts.threshold)
+print(capacity_report(checks, threshold=opts.threshold))
+blocked = [c for c in checks if c.error or c.over]
+if opts.check:
+    sys.exit(1 if blocked else 0)
+if blocked and not opts.force:
+    print('{} pools are over {:g}% or could not be checked, nothing was done (see --force).'.format(
+        len(blocked), opts.threshold))
+    sys.exit(1)
+start = time.monotonic()
+results = executor.run()
+print('End {} ({:.1f} s): {}'.format(datetime.datetime.now(), time.monotonic() - start, summary(results)))
+for result in results.values():
+    if result.status in ('failed', 'skipped'):
+        print('{} {}: {}'.format(result.status.upper(), result.key, result.error))